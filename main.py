@@ -1078,9 +1078,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         if data.get("status") == "success":
                             results = data.get("results", {})
                             for title, info in results.items():
-                                result.append(f"- {title}:")
-                                for item in info.get("data", []):
-                                    for key, value in item.items():
+                                result.append(f"- {info.get('name', title)}:")
+                                schema = info.get("schema", [])
+                                for row in info.get("rows", []):
+                                    for key, value in zip(schema, row):
                                         result.append(f"  - {key}: {value}")
                             result.append("- Статус: Успешное получение данных")
                         else:
@@ -0,0 +1,10 @@
+"""Общий httpx-клиент для прямых запросов к JSON-бэкендам парсеров.
+
+HTTP/2 мультиплексирует несколько запросов в одном TCP/TLS-соединении,
+а единый пул соединений живёт всё время работы процесса — без
+повторных рукопожатий на каждый запрос.
+"""
+import httpx
+
+LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+CLIENT = httpx.AsyncClient(http2=True, timeout=15, limits=LIMITS)
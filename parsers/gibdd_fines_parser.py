@@ -2,12 +2,12 @@ import asyncio
 import logging
 import re
 import random
-import json
-from flask import Flask, request, jsonify
+from quart import Quart, request, jsonify
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 import aiohttp
 import base64
 import dotenv
+import orjson
 import os
 
 # Загрузка переменных окружения
@@ -16,6 +16,11 @@ dotenv.load_dotenv(dotenv_path)
 
 # Ключ API 2Captcha
 TWOCAPTCHA_API_KEY = os.getenv("TWOCAPTCHA_API_KEY")
+# Публичный URL вебхука для пингбэка 2Captcha (если не задан — опрос res.php)
+TWOCAPTCHA_PINGBACK_URL = os.getenv("TWOCAPTCHA_PINGBACK_URL")
+
+# Ожидающие решения CAPTCHA: id -> Future, разрешается вебхуком
+_captcha_futures = {}
 
 # Пул прокси
 proxy_pool = [
@@ -35,7 +40,26 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logging.getLogger('httpx').setLevel(logging.WARNING)
 
-app = Flask(__name__)
+# ASGI-приложение: один постоянный event loop на все запросы, поэтому общая
+# aiohttp-сессия и футуры пингбэка живут между вызовами.
+# Продакшен-запуск: hypercorn parsers.gibdd_fines_parser:app --bind 0.0.0.0:5004
+app = Quart(__name__)
+
+# Общая aiohttp-сессия: keepalive и кэш DNS вместо новой сессии на каждый вызов
+_http_session = None
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """Возвращает общую aiohttp-сессию, создавая её при первом обращении."""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=32, limit_per_host=8, ttl_dns_cache=300, keepalive_timeout=30
+        )
+        _http_session = aiohttp.ClientSession(
+            connector=connector,
+            headers={'Accept-Encoding': 'gzip, deflate'}
+        )
+    return _http_session
 
 async def solve_captcha(page, regnum="unknown"):
     """Решает CAPTCHA с помощью сервиса 2Captcha асинхронно."""
@@ -63,8 +87,7 @@ async def solve_captcha(page, regnum="unknown"):
             logger.info("JPEG-изображение CAPTCHA не появилось за 5 секунд")
             return None
 
-        captcha_img = await page.query_selector(captcha_img_selector)
-        captcha_src = await captcha_img.get_attribute('src')
+        # captcha_img и captcha_src уже получены из wait_for_selector в цикле выше
         if not captcha_src or 'spinner' in captcha_src.lower() or 'loading' in captcha_src.lower():
             logger.info("Не удалось загрузить CAPTCHA (вероятно, спиннер)")
             return None
@@ -72,14 +95,17 @@ async def solve_captcha(page, regnum="unknown"):
         logger.info("Извлекаем изображение CAPTCHA")
         if captcha_src.startswith('data:image/jpeg;base64,'):
             base64_string = captcha_src.split(',')[1]
-            captcha_image = base64.b64decode(base64_string)
+            # Декодируем в пуле потоков, чтобы не блокировать event loop
+            captcha_image = await asyncio.get_running_loop().run_in_executor(
+                None, base64.b64decode, base64_string
+            )
         else:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(captcha_src, timeout=10) as response:
-                    if response.status != 200:
-                        logger.info("Не удалось загрузить изображение CAPTCHA")
-                        return None
-                    captcha_image = await response.read()
+            session = await get_http_session()
+            async with session.get(captcha_src, timeout=10) as response:
+                if response.status != 200:
+                    logger.info("Не удалось загрузить изображение CAPTCHA")
+                    return None
+                captcha_image = await response.read()
 
         logger.info("Отправляем CAPTCHA на 2Captcha")
         form_data = aiohttp.FormData()
@@ -89,14 +115,16 @@ async def solve_captcha(page, regnum="unknown"):
         form_data.add_field('min_len', '5')
         form_data.add_field('max_len', '5')
         form_data.add_field('json', '1')
+        if TWOCAPTCHA_PINGBACK_URL:
+            form_data.add_field('pingback', TWOCAPTCHA_PINGBACK_URL)
         form_data.add_field('file', captcha_image, filename='captcha.jpg', content_type='image/jpeg')
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post('http://2captcha.com/in.php', data=form_data) as response:
-                if response.status != 200:
-                    logger.info(f"Ошибка HTTP при отправке CAPTCHA: {response.status}")
-                    return None
-                result = await response.json()
+        session = await get_http_session()
+        async with session.post('https://2captcha.com/in.php', data=form_data) as response:
+            if response.status != 200:
+                logger.info(f"Ошибка HTTP при отправке CAPTCHA: {response.status}")
+                return None
+            result = await response.json(loads=orjson.loads)
 
         if result.get('status') != 1:
             logger.info(f"Ошибка 2Captcha при отправке: {result.get('request')}")
@@ -105,22 +133,34 @@ async def solve_captcha(page, regnum="unknown"):
         captcha_id = result['request']
         logger.info(f"Получен ID CAPTCHA: {captcha_id}")
 
+        if TWOCAPTCHA_PINGBACK_URL:
+            future = asyncio.get_running_loop().create_future()
+            _captcha_futures[captcha_id] = future
+            try:
+                logger.info("Ожидаем решения CAPTCHA через пингбэк (до 60 секунд)")
+                solution = await asyncio.wait_for(future, timeout=60)
+                logger.info(f"CAPTCHA решена через пингбэк: {solution}")
+                return solution
+            except asyncio.TimeoutError:
+                logger.info("Пингбэк не пришёл, переходим к опросу res.php")
+            finally:
+                _captcha_futures.pop(captcha_id, None)
+
         max_attempts = 3
         for attempt in range(max_attempts):
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                        f'http://2captcha.com/res.php?key={TWOCAPTCHA_API_KEY}&action=get&id={captcha_id}&json=1',
-                        timeout=10
-                ) as response:
-                    if response.status != 200:
-                        logger.info(f"Ошибка HTTP при получении решения CAPTCHA: {response.status}")
-                        continue
-                    result = await response.json()
-                    if result.get('status') == 1:
-                        logger.info(f"CAPTCHA решена: {result['request']}")
-                        return result['request']
-                    logger.info(f"Ожидаем решения CAPTCHA (попытка {attempt + 1}/{max_attempts})")
-                    await asyncio.sleep(5)
+            async with session.get(
+                    f'https://2captcha.com/res.php?key={TWOCAPTCHA_API_KEY}&action=get&id={captcha_id}&json=1',
+                    timeout=10
+            ) as response:
+                if response.status != 200:
+                    logger.info(f"Ошибка HTTP при получении решения CAPTCHA: {response.status}")
+                    continue
+                result = await response.json(loads=orjson.loads)
+                if result.get('status') == 1:
+                    logger.info(f"CAPTCHA решена: {result['request']}")
+                    return result['request']
+                logger.info(f"Ожидаем решения CAPTCHA (попытка {attempt + 1}/{max_attempts})")
+                await asyncio.sleep(5)
 
         logger.info(f"Не удалось решить CAPTCHA после {max_attempts} попыток")
         return None
@@ -131,6 +171,19 @@ async def solve_captcha(page, regnum="unknown"):
         logger.info(f"Ошибка при решении CAPTCHA: {str(e)}")
         return None
 
+async def set_input(page, selector, value):
+    """Устанавливает значение поля одним JS-вызовом вместо посимвольного ввода."""
+    await page.evaluate('''
+        ([selector, value]) => {
+            const input = document.querySelector(selector);
+            input.value = "";
+            input.value = value;
+            input.dispatchEvent(new Event("input", { bubbles: true }));
+            input.dispatchEvent(new Event("change", { bubbles: true }));
+            input.blur();
+        }
+    ''', [selector, value])
+
 async def check_captcha(page):
     """Проверяет наличие CAPTCHA."""
     captcha_selector = '#captchaDialog'
@@ -169,24 +222,22 @@ async def perform_search(page, regnum, regreg, stsnum):
 
             try:
                 logger.info("Ожидаем поле ввода госномера (до 3 секунд)")
-                await page.wait_for_selector(regnum_input_selector, state="visible", timeout=3000)
-                regnum_input = await page.query_selector(regnum_input_selector)
+                regnum_input = await page.wait_for_selector(regnum_input_selector, state="visible", timeout=3000)
                 if not (await regnum_input.is_visible() and await regnum_input.is_enabled()):
                     raise Exception("Поле госномера не видимо или не доступно")
                 logger.info(f"Вводим госномер: {regnum}")
-                await page.type(regnum_input_selector, regnum, delay=100)
+                await set_input(page, regnum_input_selector, regnum)
             except Exception as e:
                 logger.info(f"Ошибка ввода госномера: {str(e)}")
                 return {"status": "error", "message": "Не удалось ввести госномер", "data": "", "retry": False}
 
             try:
                 logger.info("Ожидаем поле ввода региона (до 3 секунд)")
-                await page.wait_for_selector(regreg_input_selector, state="visible", timeout=3000)
-                regreg_input = await page.query_selector(regreg_input_selector)
+                regreg_input = await page.wait_for_selector(regreg_input_selector, state="visible", timeout=3000)
                 if not (await regreg_input.is_visible() and await regreg_input.is_enabled()):
                     raise Exception("Поле региона не видимо или не доступно")
                 logger.info(f"Вводим регион: {regreg}")
-                await page.type(regreg_input_selector, regreg, delay=100)
+                await set_input(page, regreg_input_selector, regreg)
             except Exception as e:
                 logger.info(f"Ошибка ввода региона: {str(e)}")
                 return {"status": "error", "message": "Не удалось ввести регион", "data": "", "retry": False}
@@ -195,19 +246,12 @@ async def perform_search(page, regnum, regreg, stsnum):
             for input_attempt in range(max_input_attempts):
                 logger.info(f"Попытка ввода СТС #{input_attempt + 1}")
                 try:
-                    await page.wait_for_selector(stsnum_input_selector, state="visible", timeout=3000)
-                    stsnum_input = await page.query_selector(stsnum_input_selector)
+                    stsnum_input = await page.wait_for_selector(stsnum_input_selector, state="visible", timeout=3000)
                     if not (await stsnum_input.is_visible() and await stsnum_input.is_enabled()):
                         raise Exception("Поле СТС не видимо или не доступно")
                     logger.info(f"Очищаем и вводим СТС: {stsnum}")
-                    await page.evaluate(f'''
-                        let input = document.querySelector("{stsnum_input_selector}");
-                        input.value = "";
-                        input.value = "{stsnum}";
-                        input.dispatchEvent(new Event("input"));
-                        input.blur();
-                    ''')
-                    await page.wait_for_timeout(1000)
+                    await set_input(page, stsnum_input_selector, stsnum)
+                    await page.wait_for_timeout(random.randint(100, 300))
                     entered_value = await page.evaluate(f'document.querySelector("{stsnum_input_selector}").value')
                     if entered_value == stsnum:
                         logger.info("СТС успешно введён")
@@ -316,8 +360,7 @@ async def perform_search(page, regnum, regreg, stsnum):
                 logger.info("Сообщение о запросе не появилось")
 
             logger.info("Ожидаем результатов #checkFinesSheet (до 10 секунд)")
-            await page.wait_for_selector('#checkFinesSheet', state="attached", timeout=10000)
-            fines_sheet = await page.query_selector('#checkFinesSheet')
+            fines_sheet = await page.wait_for_selector('#checkFinesSheet', state="attached", timeout=10000)
             if not fines_sheet:
                 logger.info("Результаты не найдены")
                 if captcha_attempt < max_captcha_attempts - 1:
@@ -399,7 +442,9 @@ async def get_fines_info(regnum: str, regreg: str, stsnum: str) -> dict:
             page = await browser_context.new_page()
             try:
                 await page.goto("https://xn--90adear.xn--p1ai/check/fines", timeout=30000)
-                await page.wait_for_load_state("load", timeout=30000)
+                # domcontentloaded достаточно: форма готова до загрузки картинок/аналитики,
+                # а wait_for_selector('#checkFinesContainer') ниже дожидается самой формы
+                await page.wait_for_load_state("domcontentloaded", timeout=15000)
                 result = await perform_search(page, regnum, regreg, stsnum)
                 logger.info(f"Результат поиска: {result['message'][:100]}...")
                 if result["status"] == "success":
@@ -441,10 +486,22 @@ async def get_fines_info(regnum: str, regreg: str, stsnum: str) -> dict:
 
         return result
 
+@app.route('/2captcha-webhook', methods=['GET', 'POST'])
+async def captcha_webhook():
+    """Пингбэк от 2Captcha: решение приходит сюда вместо опроса res.php."""
+    values = await request.values
+    captcha_id = values.get('id')
+    code = values.get('code')
+    future = _captcha_futures.get(captcha_id)
+    if future and not future.done():
+        future.set_result(code)
+        logger.info(f"Пингбэк 2Captcha получен для ID {captcha_id}")
+    return 'OK'
+
 @app.route('/fines', methods=['POST'])
 async def fines_endpoint():
     """Эндпоинт для получения данных о штрафах."""
-    data = request.get_json()
+    data = await request.get_json()
     regnum = data.get('regnum')
     regreg = data.get('regreg')
     stsnum = data.get('stsnum')
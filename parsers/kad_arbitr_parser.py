@@ -1,10 +1,18 @@
 import asyncio
 import logging
+import os
 import re
 import psutil
 import time
-from flask import Flask, request, jsonify
+import httpx
+from quart import Quart, request, jsonify
 from playwright.async_api import async_playwright, Error as PlaywrightError
+from cachetools import TTLCache
+
+try:
+    from parsers._http import CLIENT as HTTP_CLIENT
+except ImportError:  # запуск файлом из каталога parsers
+    from _http import CLIENT as HTTP_CLIENT
 
 # Настройка логирования
 logging.basicConfig(
@@ -15,145 +23,394 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logging.getLogger('httpx').setLevel(logging.WARNING)
 
-app = Flask(__name__)
+# Продакшен-запуск: hypercorn parsers.kad_arbitr_parser:app --bind 0.0.0.0:5002
+app = Quart(__name__)
+
+# Ограничения. Глубина пула настраивается переменной окружения под нагрузку
+# по закону Литтла: N = пропускная способность × средняя задержка, плюс запас
+MAX_CONCURRENT_REQUESTS = int(os.getenv("KAD_POOL", "6"))
+# BoundedSemaphore: случайный release() без acquire() поднимет ValueError,
+# а не молча расширит лимит
+GLOBAL_SEMAPHORE = asyncio.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+# Регулярные выражения компилируются один раз при импорте модуля
+INN_RE = re.compile(r'^\d{10}$|^\d{12}$')
 
-# Ограничения
-MAX_CONCURRENT_REQUESTS = 2  # Параллельные запросы на сервис
-GLOBAL_SEMAPHORE = asyncio.Semaphore(10)  # Общий лимит страниц для всех сервисов
+def is_valid_inn(inn):
+    return inn and INN_RE.match(inn)
+
+# Замер памяти — это syscall на каждый вызов; включается выборочно
+# через MEM_LOG_EVERY (0 — выключено, N — каждый N-й вызов)
+_PROC = psutil.Process()
+_MEM_SAMPLE = int(os.getenv("MEM_LOG_EVERY", "0"))
+_mem_calls = 0
 
 def log_memory_usage():
-    """Логирование потребления памяти."""
-    process = psutil.Process()
-    mem_info = process.memory_info()
-    logger.info(f"Потребление памяти: {mem_info.rss / 1024 / 1024:.2f} МБ")
+    """Логирование потребления памяти (каждый MEM_LOG_EVERY-й вызов)."""
+    global _mem_calls
+    if _MEM_SAMPLE <= 0:
+        return
+    _mem_calls += 1
+    if _mem_calls % _MEM_SAMPLE:
+        return
+    logger.info("Потребление памяти: %.2f МБ", _PROC.memory_info().rss / 1024 / 1024)
+
+# Скрейпер таблицы дел устанавливается в контекст один раз через init-скрипт:
+# браузер компилирует функцию при навигации, а не при каждом вызове evaluate
+SCRAPE_CASES_JS = """
+    window.__scrapeCases = () => {
+        const rows = document.querySelectorAll('table#b-cases tbody tr');
+        const cases = [];
+        rows.forEach(row => {
+            const caseData = {};
+            const numCase = row.querySelector('a.num_case');
+            caseData.case_number = numCase ? numCase.textContent.trim() : '';
+            const date = row.querySelector('div.bankruptcy span');
+            caseData.registration_date = date ? date.textContent.trim() : '';
+            const courtCell = row.querySelector('td.court');
+            if (courtCell) {
+                const judge = courtCell.querySelector('div.judge');
+                caseData.judge = judge ? judge.textContent.trim() : '';
+                const instance = courtCell.querySelectorAll('div')[courtCell.querySelectorAll('div').length - 1];
+                caseData.current_instance = instance ? instance.textContent.trim() : '';
+            }
+            const plaintiff = row.querySelector('td.plaintiff span.js-rollover');
+            caseData.plaintiff = plaintiff ? plaintiff.textContent.trim() : '';
+            const respondent = row.querySelector('td.respondent span.js-rollover');
+            caseData.respondent = respondent ? respondent.textContent.trim() : '';
+            const rollover = row.querySelector('span.js-rolloverHtml');
+            if (rollover) {
+                const innSpan = rollover.querySelector('span.g-highlight');
+                caseData.inn = innSpan ? innSpan.textContent.trim() : '';
+            }
+            cases.push(caseData);
+        });
+        return cases;
+    };
+"""
+
+# Ресурсы, не влияющие на результат скрейпинга: не тратим на них сеть браузера
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media", "stylesheet"}
+BLOCKED_URL_PARTS = ("google-analytics", "yandex", "mediator")
+
+async def _block_unneeded(route):
+    """Отсекает картинки, шрифты и счётчики аналитики до их загрузки."""
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(part in request.url for part in BLOCKED_URL_PARTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+# Постоянный пул страниц: Playwright, CDP-подключение и контексты создаются
+# один раз на процесс и переиспользуются всеми запросами
+_playwright = None
+_browser = None
+_page_pool = None
+_pool_endpoint = None
+_pool_lock = asyncio.Lock()
+
+async def get_pool(cdp_endpoint: str = "http://localhost:9222") -> asyncio.LifoQueue:
+    """Возвращает пул прогретых страниц, создавая его при первом обращении."""
+    global _playwright, _browser, _page_pool, _pool_endpoint
+    async with _pool_lock:
+        if _page_pool is not None and cdp_endpoint != _pool_endpoint:
+            # Пул один на процесс; другой CDP-адрес в запросе обслужить нечем
+            logger.warning(f"Пул страниц создан для CDP {_pool_endpoint}, запрошенный {cdp_endpoint} игнорируется")
+        if _page_pool is None:
+            _pool_endpoint = cdp_endpoint
+            logger.info(f"Создаю пул страниц: подключение к CDP {cdp_endpoint}")
+            _playwright = await async_playwright().start()
+            _browser = await _playwright.chromium.connect_over_cdp(cdp_endpoint)
+            pool = asyncio.LifoQueue()
+            for _ in range(MAX_CONCURRENT_REQUESTS):
+                context = await _browser.new_context()
+                await context.route("**/*", _block_unneeded)
+                await context.add_init_script(SCRAPE_CASES_JS)
+                page = await context.new_page()
+                pool.put_nowait(page)
+            _page_pool = pool
+    return _page_pool
+
+# Объекты async-Playwright привязаны к циклу сервера, поэтому закрытие
+# идёт через after_serving, а не через atexit с отдельным циклом
+@app.after_serving
+async def _close_pool():
+    """Закрывает браузер и драйвер Playwright при остановке сервера."""
+    global _playwright, _browser, _page_pool
+    try:
+        if _browser is not None:
+            await _browser.close()
+        if _playwright is not None:
+            await _playwright.stop()
+    except Exception as e:
+        logger.error(f"Ошибка при закрытии пула страниц: {str(e)}")
+    _playwright = _browser = _page_pool = None
+
+# Прямой доступ к поисковому XHR kad.arbitr.ru: дешевле, чем рендеринг страницы.
+# Куки сессии снимаются с прогретой страницы пула при первом обращении.
+KAD_SEARCH_URL = "https://kad.arbitr.ru/Kad/SearchInstances"
+KAD_HEADERS = {
+    "Content-Type": "application/json",
+    "X-Requested-With": "XMLHttpRequest",
+    "Referer": "https://kad.arbitr.ru/",
+}
+_cookies_warmed = False
+_http_lock = asyncio.Lock()
+
+async def get_http_client(cdp_endpoint: str = "http://localhost:9222") -> httpx.AsyncClient:
+    """Возвращает общий httpx-клиент, прогревая куки kad.arbitr.ru при первом вызове."""
+    global _cookies_warmed
+    async with _http_lock:
+        if not _cookies_warmed:
+            pool = await get_pool(cdp_endpoint)
+            page = await pool.get()
+            try:
+                await page.goto("https://kad.arbitr.ru/", wait_until="domcontentloaded", timeout=10000)
+                cookies = await page.context.cookies()
+            finally:
+                try:
+                    await page.goto("about:blank")
+                except Exception as e:
+                    logger.error(f"Ошибка при сбросе страницы после прогрева кук: {str(e)}")
+                pool.put_nowait(page)
+            for cookie in cookies:
+                HTTP_CLIENT.cookies.set(cookie["name"], cookie["value"], domain=cookie.get("domain", ""))
+            _cookies_warmed = True
+    return HTTP_CLIENT
+
+def _parse_search_items(payload) -> list | None:
+    """Преобразует JSON ответа SearchInstances в список дел.
+
+    Возвращает None, если в ответе нет ожидаемых полей: пустой список
+    здесь означал бы ложное «дел нет» при смене формата API."""
+    if not isinstance(payload, dict):
+        return None
+    container = payload.get("Result") if isinstance(payload.get("Result"), dict) else payload
+    items = container.get("Items")
+    if items is None:
+        return None
+    cases = []
+    for item in items:
+        cases.append({
+            "case_number": item.get("CaseNumber", ""),
+            "registration_date": item.get("RegistrationDate", ""),
+            "judge": item.get("Judge", ""),
+            "current_instance": item.get("CourtName", ""),
+            "plaintiff": ", ".join(
+                p.get("Name", "") for p in (item.get("Plaintiffs") or {}).get("Participants", [])),
+            "respondent": ", ".join(
+                r.get("Name", "") for r in (item.get("Respondents") or {}).get("Participants", [])),
+            "inn": item.get("Inn", ""),
+        })
+    return cases
+
+async def search_kad_arbitr_api(inn: str, cdp_endpoint: str) -> dict | None:
+    """Поиск дел прямым POST к поисковому XHR без рендеринга страницы.
+
+    Возвращает None, если API недоступен или ответ не распознан —
+    в этом случае вызывающий код откатывается на Playwright."""
+    try:
+        client = await get_http_client(cdp_endpoint)
+        response = await client.post(KAD_SEARCH_URL, headers=KAD_HEADERS, json={
+            "Participants": [{"Name": inn}],
+            "Count": 25,
+            "Page": 1
+        })
+        if response.status_code != 200:
+            logger.warning(f"Поисковый XHR вернул {response.status_code} для ИНН {inn}, откат на Playwright")
+            return None
+        payload = response.json()
+        cases = _parse_search_items(payload)
+        if cases is None:
+            logger.warning(f"Поисковый XHR: ответ не распознан для ИНН {inn}, откат на Playwright")
+            return None
+        logger.info(f"Поисковый XHR: найдено дел для ИНН {inn}: {len(cases)}")
+        return {"status": "success", "data": {"cases": cases}, "inn": inn}
+    except Exception as e:
+        logger.warning(f"Поисковый XHR не сработал для ИНН {inn} ({str(e)}), откат на Playwright")
+        return None
+
+async def get_info_kad_arbitr_batch(inns: list, cdp_endpoint: str) -> list | None:
+    """Поиск дел по нескольким ИНН одним POST к поисковому XHR.
+
+    Строки ответа раскладываются по ИНН из подсветки участника.
+    Возвращает None при сбое API — вызывающий код обрабатывает ИНН по одному."""
+    try:
+        client = await get_http_client(cdp_endpoint)
+        response = await client.post(KAD_SEARCH_URL, headers=KAD_HEADERS, json={
+            "Participants": [{"Name": inn} for inn in inns],
+            "Count": 25 * len(inns),
+            "Page": 1
+        })
+        if response.status_code != 200:
+            logger.warning(f"Пакетный поисковый XHR вернул {response.status_code}, обрабатываю ИНН по одному")
+            return None
+        cases = _parse_search_items(response.json())
+        if cases is None:
+            logger.warning("Пакетный поисковый XHR: ответ не распознан, обрабатываю ИНН по одному")
+            return None
+        by_inn = {inn: [] for inn in inns}
+        unmatched = 0
+        for case in cases:
+            if case.get("inn") in by_inn:
+                by_inn[case["inn"]].append(case)
+            else:
+                unmatched += 1
+        if unmatched:
+            # Дело без подсветки ИНН (или совпавшее по имени) нельзя отнести
+            # к конкретному запросу — честнее разобрать пакет поштучно,
+            # чем молча потерять строки ответа
+            logger.warning(f"Пакетный поисковый XHR: {unmatched} дел без привязки к ИНН, обрабатываю по одному")
+            return None
+        logger.info(f"Пакетный поисковый XHR: найдено дел для {len(inns)} ИНН: {len(cases)}")
+        return [{"status": "success", "data": {"cases": by_inn[inn]}, "inn": inn} for inn in inns]
+    except Exception as e:
+        logger.warning(f"Пакетный поисковый XHR не сработал ({str(e)}), обрабатываю ИНН по одному")
+        return None
+
+# Повторный запрос того же ИНН в полёте ждёт результат первого,
+# а недавние успешные ответы отдаются из TTL-кеша (5 минут)
+_RESULTS_CACHE = TTLCache(maxsize=1024, ttl=300)
+_INFLIGHT = {}
+
+async def _single_flight(key, coro_factory):
+    """Возвращает закешированный или уже вычисляемый результат по ключу."""
+    cached = _RESULTS_CACHE.get(key)
+    if cached is not None:
+        return cached
+    fut = _INFLIGHT.get(key)
+    if fut is not None:
+        return await asyncio.shield(fut)
+    fut = asyncio.get_event_loop().create_future()
+    _INFLIGHT[key] = fut
+    try:
+        result = await coro_factory()
+        fut.set_result(result)
+        if isinstance(result, dict) and result.get("status") == "success":
+            _RESULTS_CACHE[key] = result
+        return result
+    except BaseException as e:
+        # BaseException, а не Exception: отмена задачи-владельца (обрыв
+        # клиента) тоже должна разрешить future, иначе ждущие под shield
+        # повиснут навсегда
+        fut.set_exception(e)
+        fut.exception()  # не оставляем "exception never retrieved", если ждущих нет
+        raise
+    finally:
+        _INFLIGHT.pop(key, None)
 
 async def get_info_kad_arbitr(inn: str, semaphore: asyncio.Semaphore, cdp_endpoint: str = "http://localhost:9222") -> dict:
+    """Получение данных с kad.arbitr.ru для одного ИНН (с дедупликацией одинаковых запросов)."""
+    return await _single_flight(inn, lambda: _get_info_kad_arbitr(inn, semaphore, cdp_endpoint))
+
+async def _get_info_kad_arbitr(inn: str, semaphore: asyncio.Semaphore, cdp_endpoint: str) -> dict:
     """Получение данных с kad.arbitr.ru для одного ИНН."""
     async with GLOBAL_SEMAPHORE:  # Ограничение общего количества страниц
-        async with async_playwright() as playwright:
-            try:
-                logger.info(f"Подключение к CDP по адресу: {cdp_endpoint} для ИНН {inn}")
-                browser = await playwright.chromium.connect_over_cdp(cdp_endpoint)
-                context = await browser.new_context()
-                start_time = time.time()
-                page = await context.new_page()
-            except PlaywrightError as e:
-                logger.error(f"Ошибка инициализации браузера для ИНН {inn}: {str(e)}")
-                return {"status": "error", "message": f"Ошибка инициализации браузера: {str(e)}", "inn": inn}
+        # Сначала пробуем лёгкий путь через поисковый XHR
+        api_result = await search_kad_arbitr_api(inn, cdp_endpoint)
+        if api_result is not None:
+            return api_result
+        try:
+            pool = await get_pool(cdp_endpoint)
+            page = await pool.get()
+            start_time = time.time()
+        except PlaywrightError as e:
+            logger.error(f"Ошибка инициализации браузера для ИНН {inn}: {str(e)}")
+            return {"status": "error", "message": f"Ошибка инициализации браузера: {str(e)}", "inn": inn}
+
+        try:
+            logger.info(f"Загружаю страницу kad.arbitr.ru для ИНН {inn}")
+            response = await page.goto("https://kad.arbitr.ru/", wait_until="domcontentloaded", timeout=10000)
+
+            # Проверка на пустую страницу
+            if not response or response.url == "about:blank":
+                logger.error(f"Пустая страница (about:blank) для ИНН {inn}")
+                return {"status": "error", "message": "Пустая страница, возможно, сбой браузера", "inn": inn}
+
+            content = await page.content()
+            if not content or "<html" not in content.lower():
+                logger.error(f"Пустое содержимое страницы для ИНН {inn}")
+                return {"status": "error", "message": "Пустое содержимое страницы", "inn": inn}
+
+            logger.info(f"Ожидаю поле ввода 'Участник дела' для ИНН {inn}")
+            await page.wait_for_selector("div#sug-participants textarea", timeout=10000)
+
+            notification = await page.query_selector("div.b-promo_notification")
+            if notification:
+                logger.info(f"Обнаружено всплывающее уведомление для ИНН {inn}, пытаюсь закрыть")
+                close_button = await page.query_selector("a.b-promo_notification-popup-close")
+                if close_button:
+                    await close_button.click()
+                    # Ждём фактического исчезновения уведомления, а не фиксированные 500 мс
+                    try:
+                        await page.wait_for_selector("div.b-promo_notification", state="detached", timeout=2000)
+                    except PlaywrightError:
+                        logger.warning(f"Уведомление не исчезло за 2 секунды для ИНН {inn}")
+                    logger.info(f"Уведомление закрыто для ИНН {inn}")
+                else:
+                    logger.warning(f"Кнопка закрытия уведомления не найдена для ИНН {inn}")
 
+
+            logger.info(f"Ввожу ИНН {inn} в поле 'Участник дела'")
+            await page.fill("div#sug-participants textarea", inn)
+            await page.click("div#b-form-submit button")
+
+            logger.info(f"Ожидаю результаты поиска для ИНН {inn}")
+            await page.wait_for_selector(
+                "div.b-results, div.b-noResults:not(.g-hidden), div.b-case-loading",
+                timeout=10000
+            )
+
+            # Ждём исчезновения индикатора загрузки на стороне браузера,
+            # без опроса через query_selector
             try:
-                logger.info(f"Загружаю страницу kad.arbitr.ru для ИНН {inn}")
-                response = await page.goto("https://kad.arbitr.ru/", wait_until="domcontentloaded", timeout=10000)
-
-                # Проверка на пустую страницу
-                if not response or response.url == "about:blank":
-                    logger.error(f"Пустая страница (about:blank) для ИНН {inn}")
-                    return {"status": "error", "message": "Пустая страница, возможно, сбой браузера", "inn": inn}
-
-                content = await page.content()
-                if not content or "<html" not in content.lower():
-                    logger.error(f"Пустое содержимое страницы для ИНН {inn}")
-                    return {"status": "error", "message": "Пустое содержимое страницы", "inn": inn}
-
-                logger.info(f"Ожидаю поле ввода 'Участник дела' для ИНН {inn}")
-                await page.wait_for_selector("div#sug-participants textarea", timeout=10000)
-
-                notification = await page.query_selector("div.b-promo_notification")
-                if notification:
-                    logger.info(f"Обнаружено всплывающее уведомление для ИНН {inn}, пытаюсь закрыть")
-                    close_button = await page.query_selector("a.b-promo_notification-popup-close")
-                    if close_button:
-                        await close_button.click()
-                        await page.wait_for_timeout(500)
-                        logger.info(f"Уведомление закрыто для ИНН {inn}")
-                    else:
-                        logger.warning(f"Кнопка закрытия уведомления не найдена для ИНН {inn}")
-
-
-                logger.info(f"Ввожу ИНН {inn} в поле 'Участник дела'")
-                await page.fill("div#sug-participants textarea", inn)
-                await page.click("div#b-form-submit button")
-
-                logger.info(f"Ожидаю результаты поиска для ИНН {inn}")
-                await page.wait_for_selector(
-                    "div.b-results, div.b-noResults:not(.g-hidden), div.b-case-loading",
-                    timeout=10000
+                await page.wait_for_function(
+                    "() => !document.querySelector(\"div.b-case-loading:not([style*='display: none'])\")",
+                    timeout=5000
                 )
+            except PlaywrightError:
+                logger.warning(f"Загрузка результатов не завершена вовремя для ИНН {inn}")
+                return {"status": "error", "message": "Загрузка результатов не завершена", "inn": inn}
 
-                async def is_loading_complete():
-                    loading = await page.query_selector("div.b-case-loading:not([style*='display: none'])")
-                    return loading is None
-
-                for _ in range(10):
-                    if await is_loading_complete():
-                        break
-                    await page.wait_for_timeout(500)
-
-                if not await is_loading_complete():
-                    logger.warning(f"Загрузка результатов не завершена вовремя для ИНН {inn}")
-                    return {"status": "error", "message": "Загрузка результатов не завершена", "inn": inn}
-
-                no_results = await page.query_selector("div.b-noResults:not(.g-hidden)")
-                if no_results:
-                    logger.info(f"Данные для ИНН {inn}: Ничего не найдено")
-                    return {"status": "success", "data": {"cases": []}, "inn": inn}
-
-                result = {"status": "success", "data": {"cases": []}, "inn": inn}
-                cases = await page.evaluate("""
-                    () => {
-                        const rows = document.querySelectorAll('table#b-cases tbody tr');
-                        const cases = [];
-                        rows.forEach(row => {
-                            const caseData = {};
-                            const numCase = row.querySelector('a.num_case');
-                            caseData.case_number = numCase ? numCase.textContent.trim() : '';
-                            const date = row.querySelector('div.bankruptcy span');
-                            caseData.registration_date = date ? date.textContent.trim() : '';
-                            const courtCell = row.querySelector('td.court');
-                            if (courtCell) {
-                                const judge = courtCell.querySelector('div.judge');
-                                caseData.judge = judge ? judge.textContent.trim() : '';
-                                const instance = courtCell.querySelectorAll('div')[courtCell.querySelectorAll('div').length - 1];
-                                caseData.current_instance = instance ? instance.textContent.trim() : '';
-                            }
-                            const plaintiff = row.querySelector('td.plaintiff span.js-rollover');
-                            caseData.plaintiff = plaintiff ? plaintiff.textContent.trim() : '';
-                            const respondent = row.querySelector('td.respondent span.js-rollover');
-                            caseData.respondent = respondent ? respondent.textContent.trim() : '';
-                            const rollover = row.querySelector('span.js-rolloverHtml');
-                            if (rollover) {
-                                const innSpan = rollover.querySelector('span.g-highlight');
-                                caseData.inn = innSpan ? innSpan.textContent.trim() : '';
-                            }
-                            cases.push(caseData);
-                        });
-                        return cases;
-                    }
-                """)
-
-                result['data']['cases'] = cases
-                logger.info(f"Найдено строк в таблице для ИНН {inn}: {len(cases)}")
-                logger.info(f"Обработка ИНН {inn} заняла {time.time() - start_time:.2f} секунд")
-                log_memory_usage()
-                return result
-
-            except PlaywrightError as e:
-                logger.error(f"Ошибка при загрузке страницы или взаимодействии для ИНН {inn}: {str(e)}")
-                return {"status": "error", "message": f"Ошибка загрузки страницы или взаимодействия: {str(e)}", "inn": inn}
-            finally:
-                try:
-                    await page.close()
-                    await context.close()
-                    await browser.close()
-                except Exception as e:
-                    logger.error(f"Ошибка при закрытии ресурсов для ИНН {inn}: {str(e)}")
+            no_results = await page.query_selector("div.b-noResults:not(.g-hidden)")
+            if no_results:
+                logger.info(f"Данные для ИНН {inn}: Ничего не найдено")
+                return {"status": "success", "data": {"cases": []}, "inn": inn}
+
+            result = {"status": "success", "data": {"cases": []}, "inn": inn}
+            cases = await page.evaluate("() => window.__scrapeCases()")
+
+            result['data']['cases'] = cases
+            logger.info(f"Найдено строк в таблице для ИНН {inn}: {len(cases)}")
+            logger.info(f"Обработка ИНН {inn} заняла {time.time() - start_time:.2f} секунд")
+            log_memory_usage()
+            return result
+
+        except PlaywrightError as e:
+            logger.error(f"Ошибка при загрузке страницы или взаимодействии для ИНН {inn}: {str(e)}")
+            return {"status": "error", "message": f"Ошибка загрузки страницы или взаимодействия: {str(e)}", "inn": inn}
+        finally:
+            # Страница возвращается в пул, браузер не закрываем
+            try:
+                await page.goto("about:blank")
+            except Exception as e:
+                logger.error(f"Ошибка при сбросе страницы для ИНН {inn}: {str(e)}")
+            pool.put_nowait(page)
+
+BATCH_SIZE = 10  # ИНН в одном пакетном запросе к поисковому XHR
 
 async def process_multiple_inns(inns: list, cdp_endpoint: str) -> list:
-    """Параллельная обработка списка ИНН."""
+    """Обработка списка ИНН: пакетные запросы по BATCH_SIZE с откатом на поштучную."""
     start_time = time.time()
     semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-    tasks = [get_info_kad_arbitr(inn, semaphore, cdp_endpoint) for inn in inns]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+    results = []
+    for i in range(0, len(inns), BATCH_SIZE):
+        batch = inns[i:i + BATCH_SIZE]
+        batch_results = await get_info_kad_arbitr_batch(batch, cdp_endpoint)
+        if batch_results is None:
+            tasks = [get_info_kad_arbitr(inn, semaphore, cdp_endpoint) for inn in batch]
+            batch_results = await asyncio.gather(*tasks, return_exceptions=True)
+        results.extend(batch_results)
     logger.info(f"Обработка {len(inns)} ИНН заняла {time.time() - start_time:.2f} секунд")
     log_memory_usage()
     return results
@@ -161,14 +418,11 @@ async def process_multiple_inns(inns: list, cdp_endpoint: str) -> list:
 @app.route('/kad_arbitr', methods=['POST'])
 async def kad_arbitr_endpoint():
     """Эндпоинт для получения данных Кад.арбитр для одного или нескольких ИНН."""
-    data = request.get_json()
+    data = await request.get_json()
     inn = data.get('inn')
     inns = data.get('inns', [])
     cdp_endpoint = data.get('cdp_endpoint', 'http://localhost:9222')
 
-    def is_valid_inn(inn):
-        return inn and re.match(r'^\d{10}$|^\d{12}$', inn)
-
     if inn and is_valid_inn(inn):
         try:
             result = await get_info_kad_arbitr(inn, asyncio.Semaphore(1), cdp_endpoint)
@@ -177,11 +431,15 @@ async def kad_arbitr_endpoint():
             logger.error(f"Ошибка обработки запроса для ИНН {inn}: {str(e)}")
             return jsonify({"status": "error", "message": f"Ошибка обработки запроса: {str(e)}"}), 500
     elif inns:
-        invalid_inns = [inn for inn in inns if not is_valid_inn(inn)]
+        # Один проход по списку: валидные и невалидные ИНН раскладываются сразу
+        _match = INN_RE.match
+        valid_inns, invalid_inns = [], []
+        for item in inns:
+            (valid_inns if item and _match(item) else invalid_inns).append(item)
         if invalid_inns:
             return jsonify({"status": "error", "message": f"Неверный формат ИНН: {invalid_inns}"}), 400
         try:
-            results = await process_multiple_inns(inns, cdp_endpoint)
+            results = await process_multiple_inns(valid_inns, cdp_endpoint)
             return jsonify({"status": "success", "results": results})
         except Exception as e:
             logger.error(f"Ошибка обработки списка ИНН: {str(e)}")
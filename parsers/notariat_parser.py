@@ -1,12 +1,12 @@
 import asyncio
 import logging
-import json
+import os
 import re
 import psutil
 import time
-from flask import Flask, request, jsonify
+from quart import Quart, request, jsonify
 from playwright.async_api import async_playwright, Error as PlaywrightError
-from bs4 import BeautifulSoup
+from cachetools import TTLCache
 
 # Настройка минимального логирования
 logging.basicConfig(
@@ -19,17 +19,97 @@ logger = logging.getLogger(__name__)
 # Подавление HTTP-логов
 logging.getLogger('httpx').setLevel(logging.WARNING)
 
-app = Flask(__name__)
+# Продакшен-запуск: hypercorn parsers.notariat_parser:app --bind 0.0.0.0:5005
+app = Quart(__name__)
 
-# Ограничения
-MAX_CONCURRENT_REQUESTS = 2  # Параллельные запросы на сервис
-GLOBAL_SEMAPHORE = asyncio.Semaphore(10)  # Общий лимит страниц
+# Ограничения. Глубина пула настраивается переменной окружения под нагрузку
+# по закону Литтла: N = пропускная способность × средняя задержка, плюс запас
+MAX_CONCURRENT_REQUESTS = int(os.getenv("NOTARIAT_POOL", "6"))
+# BoundedSemaphore: случайный release() без acquire() поднимет ValueError,
+# а не молча расширит лимит
+GLOBAL_SEMAPHORE = asyncio.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+# Регулярные выражения компилируются один раз при импорте модуля
+NAME_RE = re.compile(r'^[\w\sа-яА-ЯёЁ-]+$', re.UNICODE)
+BIRTH_DATE_RE = re.compile(r'^\d{2}\.\d{2}\.\d{4}$')
+
+def is_valid_name(name):
+    return name and NAME_RE.match(name)
+
+def is_valid_birth_date(birth_date):
+    return birth_date and BIRTH_DATE_RE.match(birth_date)
+
+# Замер памяти — это syscall на каждый вызов; включается выборочно
+# через MEM_LOG_EVERY (0 — выключено, N — каждый N-й вызов)
+_PROC = psutil.Process()
+_MEM_SAMPLE = int(os.getenv("MEM_LOG_EVERY", "0"))
+_mem_calls = 0
 
 def log_memory_usage():
-    """Логирование потребления памяти."""
-    process = psutil.Process()
-    mem_info = process.memory_info()
-    logger.info(f"Потребление памяти: {mem_info.rss / 1024 / 1024:.2f} МБ")
+    """Логирование потребления памяти (каждый MEM_LOG_EVERY-й вызов)."""
+    global _mem_calls
+    if _MEM_SAMPLE <= 0:
+        return
+    _mem_calls += 1
+    if _mem_calls % _MEM_SAMPLE:
+        return
+    logger.info("Потребление памяти: %.2f МБ", _PROC.memory_info().rss / 1024 / 1024)
+
+# Ресурсы, не влияющие на результат скрейпинга: не тратим на них сеть браузера
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media", "stylesheet"}
+BLOCKED_URL_PARTS = ("google-analytics", "yandex", "mediator")
+
+async def _block_unneeded(route):
+    """Отсекает картинки, шрифты и счётчики аналитики до их загрузки."""
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(part in request.url for part in BLOCKED_URL_PARTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+# Постоянный пул страниц: Playwright, CDP-подключение и контексты создаются
+# один раз на процесс и переиспользуются всеми запросами
+_playwright = None
+_browser = None
+_page_pool = None
+_pool_endpoint = None
+_pool_lock = asyncio.Lock()
+
+async def get_pool(cdp_endpoint: str = "http://localhost:9222") -> asyncio.LifoQueue:
+    """Возвращает пул прогретых страниц, создавая его при первом обращении."""
+    global _playwright, _browser, _page_pool, _pool_endpoint
+    async with _pool_lock:
+        if _page_pool is not None and cdp_endpoint != _pool_endpoint:
+            # Пул один на процесс; другой CDP-адрес в запросе обслужить нечем
+            logger.warning(f"Пул страниц создан для CDP {_pool_endpoint}, запрошенный {cdp_endpoint} игнорируется")
+        if _page_pool is None:
+            _pool_endpoint = cdp_endpoint
+            logger.info(f"Создаю пул страниц: подключение к CDP {cdp_endpoint}")
+            _playwright = await async_playwright().start()
+            _browser = await _playwright.chromium.connect_over_cdp(cdp_endpoint)
+            pool = asyncio.LifoQueue()
+            for _ in range(MAX_CONCURRENT_REQUESTS):
+                context = await _browser.new_context()
+                await context.route("**/*", _block_unneeded)
+                page = await context.new_page()
+                pool.put_nowait(page)
+            _page_pool = pool
+    return _page_pool
+
+# Объекты async-Playwright привязаны к циклу сервера, поэтому закрытие
+# идёт через after_serving, а не через atexit с отдельным циклом
+@app.after_serving
+async def _close_pool():
+    """Закрывает браузер и драйвер Playwright при остановке сервера."""
+    global _playwright, _browser, _page_pool
+    try:
+        if _browser is not None:
+            await _browser.close()
+        if _playwright is not None:
+            await _playwright.stop()
+    except Exception as e:
+        logger.error(f"Ошибка при закрытии пула страниц: {str(e)}")
+    _playwright = _browser = _page_pool = None
 
 def parse_date(date_str: str) -> tuple:
     """Парсинг даты из формата dd.mm.yyyy"""
@@ -41,99 +121,142 @@ def parse_date(date_str: str) -> tuple:
     except:
         return "default", "default", ""
 
-async def get_probate_case(name: str, birth_date: str, semaphore: asyncio.Semaphore, cdp_endpoint: str = "http://localhost:9222") -> str:
+# Одновременные запросы одного и того же дела схлопываются в один скрейп,
+# успешные ответы пять минут отдаются из TTL-кеша
+_RESULTS_CACHE = TTLCache(maxsize=1024, ttl=300)
+_INFLIGHT = {}
+
+async def _single_flight(key, coro_factory):
+    """Возвращает закешированный или уже вычисляемый результат по ключу."""
+    cached = _RESULTS_CACHE.get(key)
+    if cached is not None:
+        return cached
+    fut = _INFLIGHT.get(key)
+    if fut is not None:
+        return await asyncio.shield(fut)
+    fut = asyncio.get_event_loop().create_future()
+    _INFLIGHT[key] = fut
+    try:
+        result = await coro_factory()
+        fut.set_result(result)
+        if isinstance(result, dict) and result.get("status") == "success":
+            _RESULTS_CACHE[key] = result
+        return result
+    except BaseException as e:
+        # BaseException, а не Exception: отмена задачи-владельца (обрыв
+        # клиента) тоже должна разрешить future, иначе ждущие под shield
+        # повиснут навсегда
+        fut.set_exception(e)
+        fut.exception()  # не оставляем "exception never retrieved", если ждущих нет
+        raise
+    finally:
+        _INFLIGHT.pop(key, None)
+
+async def get_probate_case(name: str, birth_date: str, semaphore: asyncio.Semaphore, cdp_endpoint: str = "http://localhost:9222") -> dict:
+    """Получение данных о наследственных делах с notariat.ru (с дедупликацией одинаковых запросов)."""
+    return await _single_flight((name, birth_date), lambda: _get_probate_case(name, birth_date, semaphore, cdp_endpoint))
+
+async def _get_probate_case(name: str, birth_date: str, semaphore: asyncio.Semaphore, cdp_endpoint: str) -> dict:
     """Получение данных о наследственных делах с notariat.ru"""
     url = "https://notariat.ru/ru-ru/help/probate-cases/"
 
     async with GLOBAL_SEMAPHORE:
-        async with async_playwright() as p:
+        try:
+            logger.info(f"Подключение к CDP: {cdp_endpoint}")
+            pool = await get_pool(cdp_endpoint)
+            page = await pool.get()
+
             try:
-                logger.info(f"Подключение к CDP: {cdp_endpoint}")
-                browser = await p.chromium.connect_over_cdp(cdp_endpoint)
-                page = await browser.contexts[0].new_page()
+                logger.info("Загружаем страницу notariat.ru")
+                await page.goto(url, wait_until="domcontentloaded", timeout=10000)
+                logger.info("Ожидаем форму ввода данных (до 10 секунд)")
+                await page.wait_for_selector("input[name='name']", timeout=10000)
+                logger.info("Форма ввода данных загружена")
 
-                try:
-                    logger.info("Загружаем страницу notariat.ru")
-                    await page.goto(url, wait_until="domcontentloaded", timeout=10000)
-                    logger.info("Ожидаем форму ввода данных (до 10 секунд)")
-                    await page.wait_for_selector("input[name='name']", timeout=10000)
-                    logger.info("Форма ввода данных загружена")
-
-                    # Проверка на капчу
-                    if await page.query_selector("div.captcha"):
-                        logger.error("Обнаружена капча")
-                        return json.dumps({"status": "error", "message": "Обнаружена капча, попробуйте позже"}, ensure_ascii=False, indent=2)
-
-                    # Заполнение формы
-                    logger.info("Заполняем форму")
-                    await page.fill("input[name='name']", name)
-
-                    # Дата рождения
-                    b_day, b_month, b_year = parse_date(birth_date)
-                    await page.select_option("select[name='b-day']", value=b_day)
-                    await page.select_option("select[name='b-month']", value=b_month)
-                    await page.fill("input[name='b-year']", b_year)
-
-                    # Нажатие кнопки поиска
-                    logger.info("Нажимаем кнопку поиска")
-                    await page.click("button.js-probate-cases__submit")
-                    logger.info("Ожидаем результаты (до 15 секунд)")
-                    await page.wait_for_selector("div.probate-cases__plate_result, h5.probate-cases__result-header", timeout=15000)
-
-                    # Парсинг результатов в памяти
-                    content = await page.content()
-                    soup = BeautifulSoup(content, 'html.parser')
-
-                    result = {"status": "success", "case": {}}
-
-                    # Проверяем оба возможных варианта результатов
-                    result_block = soup.find("div", class_="probate-cases__plate_result") or \
-                                  soup.find("div", class_="probate-cases__result")
-
-                    if not result_block:
-                        logger.error("Не удалось распознать структуру результатов")
-                        return json.dumps({"status": "error", "message": "Не удалось распознать структуру результатов"},
-                                        ensure_ascii=False, indent=2)
-
-                    # Обрабатываем случай с нулевыми результатами
-                    zero_results = result_block.find("h5", class_="probate-cases__result-header")
-                    if zero_results and "0" in zero_results.get_text():
-                        logger.info("Наследственных дел не найдено")
-                        return json.dumps({
-                            "status": "success",
-                            "result": "Наследственных дел не найдено",
-                            "details": zero_results.get_text(strip=True)
-                        }, ensure_ascii=False, indent=2)
-
-                    # Обрабатываем случай с найденными данными
-                    try:
-                        result['case']['name'] = result_block.find("b", class_="js-rp__name").get_text(strip=True)
-                    except AttributeError:
-                        result['case']['name'] = "Не указано"
-
-                    try:
-                        result['case']['birth_date'] = result_block.find("b", class_="js-rp__date-birth").get_text(strip=True)
-                    except AttributeError:
-                        result['case']['birth_date'] = "Не указана"
-
-                    # Обрабатываем записи наследственных дел
-                    records = result_block.find("b", class_='probate-cases__records')
-                    result['case']['probate-cases__records'] = records.get_text(strip=True) if records else "Записей не найдено"
-                    logger.info("Данные с сайта notariat получены")
-                    log_memory_usage()
-                    return json.dumps(result, ensure_ascii=False, indent=2)
-
-                except PlaywrightError as e:
-                    logger.error(f"Ошибка Playwright: {str(e)}")
-                    return json.dumps({"status": "error", "message": str(e)}, ensure_ascii=False, indent=2)
-
-                finally:
-                    await page.close()
-                    await browser.close()
+                # Проверка на капчу
+                if await page.query_selector("div.captcha"):
+                    logger.error("Обнаружена капча")
+                    return {"status": "error", "message": "Обнаружена капча, попробуйте позже"}
+
+                # Заполнение формы
+                logger.info("Заполняем форму")
+                await page.fill("input[name='name']", name)
+
+                # Дата рождения: все три поля заполняются одним evaluate,
+                # а не тремя CDP-командами
+                b_day, b_month, b_year = parse_date(birth_date)
+                await page.evaluate("""
+                    ([day, month, year]) => {
+                        const field = name => document.querySelector(`[name='${name}']`);
+                        field('b-day').value = day;
+                        field('b-day').dispatchEvent(new Event('change', {bubbles: true}));
+                        field('b-month').value = month;
+                        field('b-month').dispatchEvent(new Event('change', {bubbles: true}));
+                        field('b-year').value = year;
+                        field('b-year').dispatchEvent(new Event('input', {bubbles: true}));
+                    }
+                """, [b_day, b_month, b_year])
+
+                # Нажатие кнопки поиска
+                logger.info("Нажимаем кнопку поиска")
+                await page.click("button.js-probate-cases__submit")
+                logger.info("Ожидаем результаты (до 15 секунд)")
+                await page.wait_for_selector("div.probate-cases__plate_result, h5.probate-cases__result-header", timeout=15000)
+
+                # Извлекаем только нужные строки прямо в браузере: без
+                # сериализации всего DOM через page.content() и разбора HTML в Python
+                data = await page.evaluate("""
+                    () => {
+                        const rb = document.querySelector('div.probate-cases__plate_result, div.probate-cases__result');
+                        if (!rb) return null;
+                        const header = rb.querySelector('h5.probate-cases__result-header');
+                        return {
+                            header: header ? header.innerText.trim() : null,
+                            name: rb.querySelector('b.js-rp__name')?.innerText?.trim(),
+                            birth_date: rb.querySelector('b.js-rp__date-birth')?.innerText?.trim(),
+                            records: rb.querySelector('b.probate-cases__records')?.innerText?.trim()
+                        };
+                    }
+                """)
+
+                if data is None:
+                    logger.error("Не удалось распознать структуру результатов")
+                    return {"status": "error", "message": "Не удалось распознать структуру результатов"}
+
+                result = {"status": "success", "case": {}}
+
+                # Обрабатываем случай с нулевыми результатами
+                if data["header"] and "0" in data["header"]:
+                    logger.info("Наследственных дел не найдено")
+                    return {
+                        "status": "success",
+                        "result": "Наследственных дел не найдено",
+                        "details": data["header"]
+                    }
+
+                # Обрабатываем случай с найденными данными
+                result['case']['name'] = data["name"] or "Не указано"
+                result['case']['birth_date'] = data["birth_date"] or "Не указана"
+                result['case']['probate-cases__records'] = data["records"] or "Записей не найдено"
+                logger.info("Данные с сайта notariat получены")
+                log_memory_usage()
+                return result
 
             except PlaywrightError as e:
-                logger.error(f"Ошибка подключения: {str(e)}")
-                return json.dumps({"status": "error", "message": str(e)}, ensure_ascii=False, indent=2)
+                logger.error(f"Ошибка Playwright: {str(e)}")
+                return {"status": "error", "message": str(e)}
+
+            finally:
+                # Страница возвращается в пул, браузер не закрываем
+                try:
+                    await page.goto("about:blank")
+                except Exception as e:
+                    logger.error(f"Ошибка при сбросе страницы: {str(e)}")
+                pool.put_nowait(page)
+
+        except PlaywrightError as e:
+            logger.error(f"Ошибка подключения: {str(e)}")
+            return {"status": "error", "message": str(e)}
 
 async def process_multiple_cases(cases: list, cdp_endpoint: str) -> list:
     """Параллельная обработка списка дел."""
@@ -148,36 +271,32 @@ async def process_multiple_cases(cases: list, cdp_endpoint: str) -> list:
 @app.route('/probate', methods=['POST'])
 async def probate_endpoint():
     """Эндпоинт для получения данных о наследственных делах с notariat.ru."""
-    data = request.get_json()
+    data = await request.get_json()
     name = data.get('name')
     birth_date = data.get('birth_date')
     cases = data.get('cases', [])
     cdp_endpoint = data.get('cdp_endpoint', 'http://localhost:9222')
 
-    def is_valid_name(name):
-        return name and re.match(r'^[\w\sа-яА-ЯёЁ-]+$', name, re.UNICODE)
-
-    def is_valid_birth_date(birth_date):
-        return birth_date and re.match(r'^\d{2}\.\d{2}\.\d{4}$', birth_date)
-
     if name and birth_date and is_valid_name(name) and is_valid_birth_date(birth_date):
         try:
             result = await get_probate_case(name, birth_date, asyncio.Semaphore(1), cdp_endpoint)
-            return jsonify(json.loads(result))
+            return jsonify(result)
         except Exception as e:
             logger.error(f"Ошибка обработки запроса для имени {name}: {str(e)}")
             return jsonify({"error": str(e)}), 500
     elif cases:
-        invalid_cases = [
-            case for case in cases
-            if not (case.get('name') and case.get('birth_date') and
-                    is_valid_name(case['name']) and is_valid_birth_date(case['birth_date']))
-        ]
+        # Один проход по списку: валидные и невалидные дела раскладываются сразу
+        _match_name, _match_date = NAME_RE.match, BIRTH_DATE_RE.match
+        valid_cases, invalid_cases = [], []
+        for case in cases:
+            ok = (case.get('name') and case.get('birth_date') and
+                  _match_name(case['name']) and _match_date(case['birth_date']))
+            (valid_cases if ok else invalid_cases).append(case)
         if invalid_cases:
             return jsonify({"error": f"Неверный формат данных: {invalid_cases}"}), 400
         try:
-            results = await process_multiple_cases(cases, cdp_endpoint)
-            parsed_results = [json.loads(result) if isinstance(result, str) else {"error": str(result)} for result in results]
+            results = await process_multiple_cases(valid_cases, cdp_endpoint)
+            parsed_results = [result if isinstance(result, dict) else {"error": str(result)} for result in results]
             return jsonify({"results": parsed_results})
         except Exception as e:
             logger.error(f"Ошибка обработки списка дел: {str(e)}")
@@ -2,9 +2,11 @@ import asyncio
 import logging
 import re
 import psutil
+import random
 import time
-from flask import Flask, request, jsonify
+from quart import Quart, request, jsonify
 from playwright.async_api import async_playwright, Error as PlaywrightError
+from cachetools import TTLCache
 import os
 import dotenv
 
@@ -17,16 +19,26 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logging.getLogger('httpx').setLevel(logging.WARNING)
 
-app = Flask(__name__)
+# Продакшен-запуск: hypercorn parsers.nsis_parser:app --bind 0.0.0.0:5006
+app = Quart(__name__)
 
-# Ограничения
-MAX_CONCURRENT_REQUESTS = 2  # Параллельные запросы на сервис
-GLOBAL_SEMAPHORE = asyncio.Semaphore(10)  # Общий лимит страниц для всех сервисов
+# Регулярные выражения компилируются один раз при импорте модуля
+VIN_RE = re.compile(r'^[A-HJ-NPR-Z0-9]{17}$', re.IGNORECASE)
+
+def is_valid_vin(vin):
+    return vin and VIN_RE.match(vin)
 
 # Загрузка переменных окружения
 dotenv_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env")
 dotenv.load_dotenv(dotenv_path)
 
+# Ограничения. Глубина пула настраивается переменной окружения под нагрузку
+# по закону Литтла: N = пропускная способность × средняя задержка, плюс запас
+MAX_CONCURRENT_REQUESTS = int(os.getenv("NSIS_POOL", "4"))
+# BoundedSemaphore: случайный release() без acquire() поднимет ValueError,
+# а не молча расширит лимит
+GLOBAL_SEMAPHORE = asyncio.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
 proxy_pool = [
     {
         "server": os.getenv("PROXY_SERVER"),
@@ -35,31 +47,140 @@ proxy_pool = [
     },
 ]
 
+# Замер памяти — это syscall на каждый вызов; включается выборочно
+# через MEM_LOG_EVERY (0 — выключено, N — каждый N-й вызов)
+_PROC = psutil.Process()
+_MEM_SAMPLE = int(os.getenv("MEM_LOG_EVERY", "0"))
+_mem_calls = 0
+
 def log_memory_usage():
-    """Логирование потребления памяти."""
-    process = psutil.Process()
-    mem_info = process.memory_info()
-    logger.info(f"Потребление памяти: {mem_info.rss / 1024 / 1024:.2f} МБ")
+    """Логирование потребления памяти (каждый MEM_LOG_EVERY-й вызов)."""
+    global _mem_calls
+    if _MEM_SAMPLE <= 0:
+        return
+    _mem_calls += 1
+    if _mem_calls % _MEM_SAMPLE:
+        return
+    logger.info("Потребление памяти: %.2f МБ", _PROC.memory_info().rss / 1024 / 1024)
+
+# Ресурсы, не влияющие на результат скрейпинга: не тратим на них сеть браузера.
+# Стили не блокируем — от них зависит определение активной вкладки формы
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}
+BLOCKED_URL_PARTS = ("google-analytics", "yandex", "mediator")
+
+async def _block_unneeded(route):
+    """Отсекает картинки, шрифты и счётчики аналитики до их загрузки."""
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(part in request.url for part in BLOCKED_URL_PARTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+# Скрейпер модального окна полиса устанавливается в контекст один раз через
+# init-скрипт: браузер компилирует функцию при навигации, а не при каждом evaluate
+SCRAPE_POLICY_JS = """
+    window.__scrapePolicy = () => {
+        const policyModal = document.querySelector('div.policyDataModal');
+        if (!policyModal) return null;
+
+        const policy = {};
+        const dateSlot = policyModal.querySelector('div.policyDataModal__dateSlot');
+        if (dateSlot) {
+            policy.check_date = dateSlot.textContent.trim();
+        }
+
+        const dataLists = policyModal.querySelectorAll('dl.dataList__list');
+        dataLists.forEach(dataList => {
+            const items = dataList.querySelectorAll('div.dataList__item');
+            items.forEach(item => {
+                const label = item.querySelector('dt')?.textContent.trim().replace(':', '').toLowerCase().replace(/\\s+/g, '_');
+                const value = item.querySelector('dd')?.textContent.trim();
+                if (label && value) {
+                    policy[label] = value;
+                }
+            });
+        });
+        return policy;
+    };
+"""
+
+# Постоянный пул страниц: Playwright, CDP-подключение и контексты создаются
+# один раз на процесс и переиспользуются всеми запросами
+_playwright = None
+_browser = None
+_page_pool = None
+_pool_endpoint = None
+_pool_lock = asyncio.Lock()
+
+async def get_pool(cdp_endpoint: str = "http://localhost:9222") -> asyncio.LifoQueue:
+    """Возвращает пул прогретых страниц, создавая его при первом обращении."""
+    global _playwright, _browser, _page_pool, _pool_endpoint
+    async with _pool_lock:
+        if _page_pool is not None and cdp_endpoint != _pool_endpoint:
+            # Пул один на процесс; другой CDP-адрес в запросе обслужить нечем
+            logger.warning(f"Пул страниц создан для CDP {_pool_endpoint}, запрошенный {cdp_endpoint} игнорируется")
+        if _page_pool is None:
+            _pool_endpoint = cdp_endpoint
+            logger.info(f"Создаю пул страниц: подключение к CDP {cdp_endpoint}")
+            _playwright = await async_playwright().start()
+            _browser = await _playwright.chromium.connect_over_cdp(cdp_endpoint)
+            pool = asyncio.LifoQueue()
+            for _ in range(MAX_CONCURRENT_REQUESTS):
+                context = await _browser.new_context(proxy=proxy_pool[0])
+                await context.route("**/*", _block_unneeded)
+                await context.add_init_script(SCRAPE_POLICY_JS)
+                page = await context.new_page()
+                pool.put_nowait(page)
+            _page_pool = pool
+    return _page_pool
+
+# Объекты async-Playwright привязаны к циклу сервера, поэтому закрытие
+# идёт через after_serving, а не через atexit с отдельным циклом
+@app.after_serving
+async def _close_pool():
+    """Закрывает браузер и драйвер Playwright при остановке сервера."""
+    global _playwright, _browser, _page_pool
+    try:
+        if _browser is not None:
+            await _browser.close()
+        if _playwright is not None:
+            await _playwright.stop()
+    except Exception as e:
+        logger.error(f"Ошибка при закрытии пула страниц: {str(e)}")
+    _playwright = _browser = _page_pool = None
 
 async def attempt_osago_check(page, vin: str) -> tuple:
     """Выполняет попытку проверки ОСАГО и возвращает результат."""
     url = "https://nsis.ru/products/osago/check/"
     try:
-        logger.info(f"Загружаю страницу nsis.ru для VIN {vin}")
-        await page.goto(url, wait_until="load", timeout=45000)
+        if getattr(page, "_nsis_initialized", False):
+            # Форма уже загружена прошлым запросом на этой странице:
+            # убираем старые модальные окна и очищаем поле без навигации
+            logger.info(f"Переиспользую загруженную форму nsis.ru для VIN {vin}")
+            await page.evaluate("""
+                () => {
+                    document.querySelectorAll('div.policyDataModal, div#modal-policy-not-found, div#modal-error')
+                        .forEach(modal => modal.remove());
+                    const input = document.querySelector("input[name='vin']");
+                    if (input) input.value = '';
+                }
+            """)
+        else:
+            logger.info(f"Загружаю страницу nsis.ru для VIN {vin}")
+            await page.goto(url, wait_until="load", timeout=45000)
 
-        # Проверка на превышение лимита запросов
-        info_block = await page.query_selector("div.infoBlock")
-        if info_block and "Вы превысили количество запросов" in await info_block.inner_text():
-            return {"status": "error", "message": "Превышен лимит запросов в час", "vin": vin}, False
+            # Проверка на превышение лимита запросов
+            info_block = await page.query_selector("div.infoBlock")
+            if info_block and "Вы превысили количество запросов" in await info_block.inner_text():
+                return {"status": "error", "message": "Превышен лимит запросов в час", "vin": vin}, False
 
-        await page.wait_for_selector("input[name='vin']", timeout=10000)
+            await page.wait_for_selector("input[name='vin']", timeout=10000)
 
-        # Проверка активной вкладки
-        active_tab = await page.query_selector("ul.tabs__nav li.tabs__navItem button.btn--isActive")
-        if not active_tab or "По транспортному средству (ТС)" not in await active_tab.inner_text():
-            logger.info(f"Переключаюсь на вкладку 'По транспортному средству (ТС)' для VIN {vin}")
-            await page.click("ul.tabs__nav li.tabs__navItem button:has-text('По транспортному средству (ТС)')")
+            # Проверка активной вкладки
+            active_tab = await page.query_selector("ul.tabs__nav li.tabs__navItem button.btn--isActive")
+            if not active_tab or "По транспортному средству (ТС)" not in await active_tab.inner_text():
+                logger.info(f"Переключаюсь на вкладку 'По транспортному средству (ТС)' для VIN {vin}")
+                await page.click("ul.tabs__nav li.tabs__navItem button:has-text('По транспортному средству (ТС)')")
 
         logger.info(f"Ввожу VIN {vin}")
         await page.fill("input[name='vin']", vin)
@@ -70,6 +191,8 @@ async def attempt_osago_check(page, vin: str) -> tuple:
             "div.policyDataModal, div#modal-policy-not-found, div#modal-error",
             timeout=15000
         )
+        # Форма отработала — следующий VIN на этой странице обойдётся без навигации
+        page._nsis_initialized = True
 
         # Проверка на окно отсутствия данных
         not_found_modal = await page.query_selector("div#modal-policy-not-found")
@@ -83,32 +206,8 @@ async def attempt_osago_check(page, vin: str) -> tuple:
             logger.warning(f"Обнаружено окно ошибки для VIN {vin}")
             return {"status": "error", "message": "Ошибка на сайте", "vin": vin}, True
 
-        # Данные найдены, извлекаем их
-        policy_data = await page.evaluate("""
-            () => {
-                const policyModal = document.querySelector('div.policyDataModal');
-                if (!policyModal) return null;
-
-                const policy = {};
-                const dateSlot = policyModal.querySelector('div.policyDataModal__dateSlot');
-                if (dateSlot) {
-                    policy.check_date = dateSlot.textContent.trim();
-                }
-
-                const dataLists = policyModal.querySelectorAll('dl.dataList__list');
-                dataLists.forEach(dataList => {
-                    const items = dataList.querySelectorAll('div.dataList__item');
-                    items.forEach(item => {
-                        const label = item.querySelector('dt')?.textContent.trim().replace(':', '').toLowerCase().replace(/\\s+/g, '_');
-                        const value = item.querySelector('dd')?.textContent.trim();
-                        if (label && value) {
-                            policy[label] = value;
-                        }
-                    });
-                });
-                return policy;
-            }
-        """)
+        # Данные найдены, извлекаем их предустановленным скрейпером
+        policy_data = await page.evaluate("() => window.__scrapePolicy()")
 
         if not policy_data:
             logger.warning(f"Не удалось извлечь данные для VIN {vin}")
@@ -121,60 +220,97 @@ async def attempt_osago_check(page, vin: str) -> tuple:
         logger.error(f"Ошибка Playwright для VIN {vin}: {str(e)}")
         return {"status": "error", "message": f"Ошибка загрузки страницы: {str(e)}", "vin": vin}, True
 
+# Повторный запрос того же VIN в полёте ждёт результат первого,
+# а недавние успешные ответы отдаются из TTL-кеша (5 минут)
+_RESULTS_CACHE = TTLCache(maxsize=1024, ttl=300)
+_INFLIGHT = {}
+
+async def _single_flight(key, coro_factory):
+    """Возвращает закешированный или уже вычисляемый результат по ключу."""
+    cached = _RESULTS_CACHE.get(key)
+    if cached is not None:
+        return cached
+    fut = _INFLIGHT.get(key)
+    if fut is not None:
+        return await asyncio.shield(fut)
+    fut = asyncio.get_event_loop().create_future()
+    _INFLIGHT[key] = fut
+    try:
+        result = await coro_factory()
+        fut.set_result(result)
+        if isinstance(result, dict) and result.get("status") == "success":
+            _RESULTS_CACHE[key] = result
+        return result
+    except BaseException as e:
+        # BaseException, а не Exception: отмена задачи-владельца (обрыв
+        # клиента) тоже должна разрешить future, иначе ждущие под shield
+        # повиснут навсегда
+        fut.set_exception(e)
+        fut.exception()  # не оставляем "exception never retrieved", если ждущих нет
+        raise
+    finally:
+        _INFLIGHT.pop(key, None)
+
 async def get_info_osago(vin: str, semaphore: asyncio.Semaphore, cdp_endpoint: str = "http://localhost:9222") -> dict:
-    """Основная функция получения данных ОСАГО для одного VIN."""
+    """Основная функция получения данных ОСАГО для одного VIN (с дедупликацией одинаковых запросов)."""
+    return await _single_flight(vin, lambda: _get_info_osago(vin, semaphore, cdp_endpoint))
+
+async def _get_info_osago(vin: str, semaphore: asyncio.Semaphore, cdp_endpoint: str) -> dict:
+    """Выполняет скрейп ОСАГО для одного VIN."""
     async with GLOBAL_SEMAPHORE:
-        async with async_playwright() as p:
-            try:
-                logger.info(f"Подключение к CDP по адресу: {cdp_endpoint} для VIN {vin}")
-                browser = await p.chromium.connect_over_cdp(cdp_endpoint)
-                context = await browser.new_context(proxy=proxy_pool[0])
-                start_time = time.time()
-                page = await context.new_page()
-            except PlaywrightError as e:
-                logger.error(f"Ошибка инициализации браузера для VIN {vin}: {str(e)}")
-                return {"status": "error", "message": f"Ошибка инициализации браузера: {str(e)}", "vin": vin}
+        try:
+            logger.info(f"Подключение к CDP по адресу: {cdp_endpoint} для VIN {vin}")
+            pool = await get_pool(cdp_endpoint)
+            page = await pool.get()
+            start_time = time.time()
+        except PlaywrightError as e:
+            logger.error(f"Ошибка инициализации браузера для VIN {vin}: {str(e)}")
+            return {"status": "error", "message": f"Ошибка инициализации браузера: {str(e)}", "vin": vin}
 
-            max_attempts = 3
-            last_error = None
+        max_attempts = 3
+        last_error = None
 
+        def backoff_delay(attempt: int) -> float:
+            """Экспоненциальная задержка с джиттером: 0.5с, 1.5с, 4.5с ±30%."""
+            return 0.5 * 3 ** (attempt - 1) * random.uniform(0.7, 1.3)
+
+        try:
             for attempt in range(1, max_attempts + 1):
                 try:
                     result, can_retry = await attempt_osago_check(page, vin)
                     if not can_retry:
                         logger.info(f"Обработка VIN {vin} завершена за {time.time() - start_time:.2f} секунд")
                         log_memory_usage()
-                        await page.close()
-                        await context.close()
-                        await browser.close()
                         return result
 
-                    logger.info(f"Попытка {attempt} для VIN {vin} не удалась, повторная попытка через 3 секунды")
-                    await page.close()
-                    page = await context.new_page()  # Пересоздаем страницу для новой попытки
-                    await page.wait_for_timeout(3000)
+                    delay = backoff_delay(attempt)
+                    logger.info(f"Попытка {attempt} для VIN {vin} не удалась, повторная попытка через {delay:.1f} секунды")
+                    page._nsis_initialized = False
+                    await page.goto("about:blank")  # Сбрасываем состояние страницы для новой попытки
+                    await asyncio.sleep(delay)
 
                 except Exception as e:
                     last_error = str(e)
                     logger.error(f"Попытка {attempt} для VIN {vin} не удалась: {str(e)}")
                     if attempt < max_attempts:
-                        logger.info(f"Ожидаю 3 секунды перед повторной попыткой для VIN {vin}")
-                        await page.close()
-                        page = await context.new_page()  # Пересоздаем страницу
-                        await page.wait_for_timeout(3000)
+                        delay = backoff_delay(attempt)
+                        logger.info(f"Ожидаю {delay:.1f} секунды перед повторной попыткой для VIN {vin}")
+                        page._nsis_initialized = False
+                        await page.goto("about:blank")
+                        await asyncio.sleep(delay)
                         continue
-                    await page.close()
-                    await context.close()
-                    await browser.close()
                     return {"status": "error", "message": f"Ошибка после {max_attempts} попыток: {last_error}", "vin": vin}
 
-            try:
-                await page.close()
-                await context.close()
-                await browser.close()
-            except Exception as e:
-                logger.error(f"Ошибка при закрытии ресурсов для VIN {vin}: {str(e)}")
             return {"status": "error", "message": f"Неизвестная ошибка после {max_attempts} попыток", "vin": vin}
+        finally:
+            # Страница возвращается в пул; прогретую форму не сбрасываем,
+            # чтобы следующий VIN обошёлся без навигации
+            if not getattr(page, "_nsis_initialized", False):
+                try:
+                    await page.goto("about:blank")
+                except Exception as e:
+                    logger.error(f"Ошибка при сбросе страницы для VIN {vin}: {str(e)}")
+            pool.put_nowait(page)
 
 async def process_multiple_vins(vins: list, cdp_endpoint: str) -> list:
     """Параллельная обработка списка VIN."""
@@ -189,14 +325,11 @@ async def process_multiple_vins(vins: list, cdp_endpoint: str) -> list:
 @app.route('/osago', methods=['POST'])
 async def osago_handler():
     """Обработчик запроса проверки ОСАГО для одного или нескольких VIN."""
-    data = request.get_json()
+    data = await request.get_json()
     vin = data.get('vin')
     vins = data.get('vins', [])
     cdp_endpoint = data.get('cdp_endpoint', 'http://localhost:9222')
 
-    def is_valid_vin(vin):
-        return vin and re.match(r'^[A-HJ-NPR-Z0-9]{17}$', vin, re.IGNORECASE)
-
     if vin and is_valid_vin(vin):
         try:
             result = await get_info_osago(vin, asyncio.Semaphore(1), cdp_endpoint)
@@ -205,11 +338,15 @@ async def osago_handler():
             logger.error(f"Ошибка обработки запроса для VIN {vin}: {str(e)}")
             return jsonify({"status": "error", "message": f"Ошибка обработки запроса: {str(e)}"}), 500
     elif vins:
-        invalid_vins = [vin for vin in vins if not is_valid_vin(vin)]
+        # Один проход по списку: валидные и невалидные VIN раскладываются сразу
+        _match = VIN_RE.match
+        valid_vins, invalid_vins = [], []
+        for item in vins:
+            (valid_vins if item and _match(item) else invalid_vins).append(item)
         if invalid_vins:
             return jsonify({"status": "error", "message": f"Неверный формат VIN: {invalid_vins}"}), 400
         try:
-            results = await process_multiple_vins(vins, cdp_endpoint)
+            results = await process_multiple_vins(valid_vins, cdp_endpoint)
             return jsonify({"status": "success", "results": results})
         except Exception as e:
             logger.error(f"Ошибка обработки списка VIN: {str(e)}")
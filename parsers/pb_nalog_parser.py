@@ -1,10 +1,13 @@
 import asyncio
+import json
 import logging
 import re
+import orjson
 import psutil
 import time
-from flask import Flask, request, jsonify
+from quart import Quart, request
 from playwright.async_api import async_playwright, Error as PlaywrightError
+from cachetools import TTLCache
 
 # Настройка логирования
 logging.basicConfig(
@@ -15,217 +18,470 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logging.getLogger('httpx').setLevel(logging.WARNING)
 
-app = Flask(__name__)
+# Продакшен-запуск: hypercorn parsers.pb_nalog_parser:app --bind 0.0.0.0:5007
+app = Quart(__name__)
+
+# Локальная замена quart.jsonify: orjson сериализует большие пакеты
+# результатов в разы быстрее stdlib json и с меньшим давлением на GC
+def jsonify(obj, status=200):
+    return app.response_class(orjson.dumps(obj), status=status, mimetype="application/json")
+
 
 # Ограничения
 MAX_CONCURRENT_REQUESTS = 2  # Параллельные запросы на сервис
-GLOBAL_SEMAPHORE = asyncio.Semaphore(10)  # Общий лимит страниц для всех сервисов
+_PAGE_LIMIT = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)  # Единый лимит одновременных скрейпов
+
+# Шаблон ИНН компилируется один раз при импорте модуля
+INN_RE = re.compile(r'^(?:\d{10}|\d{12})$')
+
+def is_valid_inn(inn):
+    return inn and INN_RE.match(inn)
+
+# Объект процесса создаётся один раз; сами записи прорежены по времени —
+# под нагрузкой память меняется медленнее, чем приходят запросы
+_PROC = psutil.Process()
+_MEM_LOG_INTERVAL = 5.0
+_last_mem_log = 0.0
 
 def log_memory_usage():
-    """Логирование потребления памяти."""
-    process = psutil.Process()
-    mem_info = process.memory_info()
+    """Логирование потребления памяти, не чаще раза в _MEM_LOG_INTERVAL секунд."""
+    global _last_mem_log
+    now = time.monotonic()
+    if now - _last_mem_log < _MEM_LOG_INTERVAL:
+        return
+    _last_mem_log = now
+    mem_info = _PROC.memory_info()
     logger.info(f"Потребление памяти: {mem_info.rss / 1024 / 1024:.2f} МБ")
 
-async def get_info_nalog(inn: str, semaphore: asyncio.Semaphore, cdp_endpoint: str = "http://localhost:9222") -> dict:
-    """Получение данных с pb.nalog.ru для одного ИНН."""
-    async with GLOBAL_SEMAPHORE:
-        async with async_playwright() as p:
+# Картинки, шрифты и счётчики не влияют на результат — обрываем их на роутере
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media", "stylesheet"}
+BLOCKED_URL_PARTS = ("google-analytics", "mc.yandex", "mail.ru")
+
+async def _block_unneeded(route):
+    """Обрывает запросы к ресурсам, не нужным для скрейпинга."""
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(part in request.url for part in BLOCKED_URL_PARTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+# Извлечение групп результатов устанавливается в контекст один раз:
+# браузер компилирует функцию при навигации, а не при каждом evaluate.
+# Записи возвращаются колоночно: общий schema с подписями на группу и
+# rows со значениями-массивами — без тысяч мелких объектов с одинаковыми ключами
+EXTRACT_GROUPS_JS = """
+    window.__extractPbNalog = () => {
+        const groups = window.__GROUPS;
+        const result = {};
+        groups.forEach(group => {
+            const groupDiv = document.querySelector(`div#${group.id}`);
+            if (!groupDiv) return;
+            const dataDiv = groupDiv.querySelector('div.data:not(.d-none)');
+            if (!dataDiv) return;
+            let schema = null;
+            const rows = [];
+            const items = dataDiv.querySelectorAll('dl, tr');
+            items.forEach(item => {
+                const labels = [];
+                const values = [];
+                if (item.tagName.toLowerCase() === 'dl') {
+                    const dts = item.querySelectorAll('dt');
+                    const dds = item.querySelectorAll('dd');
+                    dts.forEach((dt, i) => {
+                        labels.push(dt.textContent.trim().replace(':', '').toLowerCase().replace(/\\s+/g, '_'));
+                        values.push(dds[i] ? dds[i].textContent.trim() : '');
+                    });
+                } else if (item.tagName.toLowerCase() === 'tr') {
+                    const cells = item.querySelectorAll('th, td');
+                    for (let i = 0; i < cells.length; i += 2) {
+                        labels.push(cells[i].textContent.trim().replace(':', '').toLowerCase().replace(/\\s+/g, '_'));
+                        values.push(cells[i + 1] ? cells[i + 1].textContent.trim() : '');
+                    }
+                }
+                if (values.length > 0) {
+                    if (schema === null) schema = labels;
+                    rows.push(values);
+                }
+            });
+            if (rows.length > 0) {
+                result[group.key] = { name: group.name, schema: schema, rows: rows };
+            }
+        });
+        return result;
+    };
+    window.__pbResult = () => {
+        const alertDiv = document.querySelector('div.alert');
+        const noData = document.querySelector('div.no-data:not(.d-none)');
+        return {
+            alert: alertDiv ? alertDiv.innerText : null,
+            noData: noData ? noData.innerText : null,
+            groups: window.__extractPbNalog()
+        };
+    };
+"""
+
+# Постоянный Playwright и пул тёплых контекстов: CDP-подключение
+# выполняется один раз на процесс, а не на каждый запрос
+_playwright = None
+_browser = None
+_context_pool = None
+_pool_endpoint = None
+_pool_lock = asyncio.Lock()
+
+async def get_context_pool(cdp_endpoint: str = "http://localhost:9222") -> asyncio.LifoQueue:
+    """Возвращает пул контекстов, создавая его при первом обращении."""
+    global _playwright, _browser, _context_pool, _pool_endpoint
+    async with _pool_lock:
+        if _context_pool is not None and cdp_endpoint != _pool_endpoint:
+            # Пул один на процесс; другой CDP-адрес в запросе обслужить нечем
+            logger.warning(f"Пул контекстов создан для CDP {_pool_endpoint}, запрошенный {cdp_endpoint} игнорируется")
+        if _context_pool is None:
+            _pool_endpoint = cdp_endpoint
+            logger.info(f"Создаю пул контекстов: подключение к CDP {cdp_endpoint}")
+            _playwright = await async_playwright().start()
+            _browser = await _playwright.chromium.connect_over_cdp(cdp_endpoint)
+            pool = asyncio.LifoQueue()
+            for _ in range(MAX_CONCURRENT_REQUESTS):
+                context = await _browser.new_context()
+                await context.route("**/*", _block_unneeded)
+                await context.add_init_script(f"window.__GROUPS = {json.dumps(GROUPS, ensure_ascii=False)};")
+                await context.add_init_script(EXTRACT_GROUPS_JS)
+                pool.put_nowait(context)
+            _context_pool = pool
+    return _context_pool
+
+# Драйвер Playwright (процесс node) поднимается один раз на старте
+# сервера, а не лениво на первом запросе, и гасится вместе с ним
+@app.before_serving
+async def _startup_pool():
+    """Создаёт пул контекстов и прогревает сайт до приёма первого запроса."""
+    # Недоступный на старте CDP не валит сервис: пул тогда создастся
+    # лениво первым запросом, а до тех пор клиенты получают ошибку в ответе
+    try:
+        pool = await get_context_pool()
+    except Exception as e:
+        logger.warning(f"Пул контекстов на старте не создан: {str(e)}")
+        return
+    # Первый заход платит за DNS, TLS и холодный HTTP-кеш — делаем его до
+    # прихода трафика; контекст с куками и TLS-сессией возвращается в пул
+    context = await pool.get()
+    try:
+        warm = await context.new_page()
+        try:
+            await warm.goto("https://pb.nalog.ru/index.html", wait_until="domcontentloaded", timeout=20000)
+        finally:
+            await warm.close()
+    except Exception as e:
+        logger.warning(f"Прогрев pb.nalog.ru не удался: {str(e)}")
+    finally:
+        pool.put_nowait(context)
+
+@app.after_serving
+async def _shutdown_pool():
+    """Закрывает браузер и драйвер Playwright при остановке сервера."""
+    global _playwright, _browser, _context_pool
+    try:
+        if _browser is not None:
+            await _browser.close()
+        if _playwright is not None:
+            await _playwright.stop()
+    except Exception as e:
+        logger.error(f"Ошибка при закрытии пула контекстов: {str(e)}")
+    _playwright = _browser = _context_pool = None
+
+# JSON-бэкенд поиска, в который форма pb.nalog.ru шлёт запросы сама;
+# прямой POST обходится без рендеринга страницы и разбора DOM
+PB_SEARCH_URL = "https://pb.nalog.ru/search-proc.json"
+# Спецификация групп результатов — единственный источник и для Python,
+# и для браузера (уезжает в контекст через init-скрипт)
+GROUPS = [
+    {"key": "ul", "name": "Организации", "id": "resultul"},
+    {"key": "ip", "name": "Индивидуальные предприниматели", "id": "resultip"},
+    {"key": "upr", "name": "Руководители", "id": "resultupr"},
+    {"key": "uchr", "name": "Учредители", "id": "resultuchr"},
+    {"key": "rdl", "name": "Дисквалификация", "id": "resultrdl"},
+    {"key": "addr", "name": "Адреса ЮЛ", "id": "resultaddr"},
+    {"key": "ogrfl", "name": "Ограничения ФЛ", "id": "resultogrfl"},
+    {"key": "ogrul", "name": "Ограничения ЮЛ", "id": "resultogrul"},
+    {"key": "docul", "name": "Документы ЮЛ", "id": "resultdocul"},
+    {"key": "docip", "name": "Документы ИП", "id": "resultdocip"},
+]
+PB_GROUP_NAMES = {group["key"]: group["name"] for group in GROUPS}
+
+async def search_nalog_api(context, inn: str) -> dict | None:
+    """Поиск по ИНН прямым POST к search-proc.json.
+
+    Возвращает None, если API недоступен или ответ не распознан —
+    в этом случае вызывающий код проходит обычный сценарий с формой."""
+    try:
+        response = await context.request.post(PB_SEARCH_URL, form={
+            "mode": "search-all",
+            "queryAll": inn,
+            "page": "1",
+            "pageSize": "20",
+        })
+        if response.status != 200:
+            logger.warning(f"search-proc.json вернул {response.status} для ИНН {inn}, перехожу к форме")
+            return None
+        payload = await response.json()
+        if not isinstance(payload, dict) or not any(key in payload for key in PB_GROUP_NAMES):
+            # 200 с JSON незнакомой формы (ошибка, токен, смена схемы) —
+            # это не «ничего не найдено», а повод уйти на форму
+            logger.warning(f"search-proc.json: ответ не распознан для ИНН {inn}, перехожу к форме")
+            return None
+        groups_data = {}
+        for key, name in PB_GROUP_NAMES.items():
+            group = payload.get(key)
+            records = group.get("data") if isinstance(group, dict) else group
+            if not records:
+                continue
+            # Приводим к колоночному виду, как у DOM-извлекателя:
+            # общий schema на группу и строки-массивы значений
+            if isinstance(records[0], dict):
+                schema = list(records[0].keys())
+                rows = [[record.get(col, "") for col in schema] for record in records]
+            else:
+                schema = []
+                rows = records
+            groups_data[key] = {"name": name, "schema": schema, "rows": rows}
+        logger.info(f"search-proc.json: найдено групп данных для ИНН {inn}: {len(groups_data)}")
+        return {"status": "success", "results": groups_data, "inn": inn}
+    except Exception as e:
+        logger.warning(f"search-proc.json не сработал для ИНН {inn} ({str(e)}), перехожу к форме")
+        return None
+
+# Повторные обращения за тем же ИНН в течение часа отдаются из кеша,
+# а одновременные дубли схлопываются в один скрейп
+_RESULTS_CACHE = TTLCache(maxsize=10_000, ttl=3600)
+_INFLIGHT = {}
+
+async def _single_flight(key, coro_factory, disable_cache=False):
+    """Возвращает закешированный или уже вычисляемый результат по ключу."""
+    if not disable_cache:
+        cached = _RESULTS_CACHE.get(key)
+        if cached is not None:
+            return cached
+    fut = _INFLIGHT.get(key)
+    if fut is not None:
+        return await asyncio.shield(fut)
+    fut = asyncio.get_event_loop().create_future()
+    _INFLIGHT[key] = fut
+    try:
+        result = await coro_factory()
+        fut.set_result(result)
+        if isinstance(result, dict) and result.get("status") == "success":
+            _RESULTS_CACHE[key] = result
+        return result
+    except BaseException as e:
+        # BaseException, а не Exception: отмена задачи-владельца (обрыв
+        # клиента) тоже должна разрешить future, иначе ждущие под shield
+        # повиснут навсегда
+        fut.set_exception(e)
+        fut.exception()  # гасим "exception never retrieved", если ждущих нет
+        raise
+    finally:
+        _INFLIGHT.pop(key, None)
+
+async def get_info_nalog(inn: str, cdp_endpoint: str = "http://localhost:9222", disable_cache: bool = False) -> dict:
+    """Получение данных с pb.nalog.ru для одного ИНН (с кешем и дедупликацией)."""
+    return await _single_flight(inn, lambda: _get_info_nalog(inn, cdp_endpoint), disable_cache)
+
+async def _alert_limit(page) -> bool:
+    """Проверяет предупреждение о лимите запросов одним evaluate с булевым ответом."""
+    return await page.evaluate(
+        "() => { const a = document.querySelector('div.alert'); "
+        "return !!(a && a.innerText.includes('превысили')); }"
+    )
+
+async def _scrape(page, inn: str) -> dict:
+    """Проходит сценарий поиска pb.nalog.ru на готовой странице."""
+    max_attempts = 3
+    last_error = None
+
+    for attempt in range(1, max_attempts + 1):
+        try:
+            url = "https://pb.nalog.ru/index.html"
+            logger.info(f"Попытка {attempt} из {max_attempts}: Загружаю страницу pb.nalog.ru для ИНН {inn}")
+            await page.goto(url, wait_until="load", timeout=20000)
+
+            # Проверка на пустую страницу
+            if page.url == "about:blank":
+                logger.error(f"Пустая страница для ИНН {inn} на попытке {attempt}")
+                if attempt < max_attempts:
+                    await page.wait_for_timeout(3000)
+                    continue
+                return {"status": "error", "message": "Пустая страница, возможно, сбой браузера", "inn": inn}
+
+            content = await page.content()
+            if not content or "<html" not in content.lower():
+                logger.error(f"Пустое содержимое страницы для ИНН {inn} на попытке {attempt}")
+                if attempt < max_attempts:
+                    await page.wait_for_timeout(3000)
+                    continue
+                return {"status": "error", "message": "Пустое содержимое страницы", "inn": inn}
+
+            # Проверка на предупреждение о превышении лимита запросов
+            if await _alert_limit(page):
+                logger.warning(f"Превышен лимит запросов для ИНН {inn}")
+                return {"status": "error", "message": "Превышен лимит запросов. Пожалуйста, подождите до начала следующего часа.", "inn": inn}
+
+            # Ожидание поля ввода
+            logger.info(f"Ожидаю поле ввода для ИНН {inn}")
+            await page.wait_for_selector("input#queryAll", timeout=10000)
+
+            # Проверка активного режима "Общий поиск"
+            active_mode = await page.query_selector("input#m_search-all:checked")
+            if not active_mode:
+                logger.info(f"Переключаюсь на режим 'Общий поиск' для ИНН {inn}")
+                await page.click("label[for='m_search-all']")
+                await page.wait_for_selector("input#m_search-all:checked", timeout=2000)
+
+            # Ввод ИНН и отправка формы
+            logger.info(f"Ввожу ИНН {inn} в поле")
+            await page.fill("input#queryAll", inn)
+            logger.info(f"Нажимаю кнопку 'Искать' для ИНН {inn}")
+            await page.click("button.btn.btn-warning[type='submit']")
+
+            # Ожидание результата по факту ответа поиска, а не фиксированные 7 секунд
+            logger.info(f"Ожидаю результат поиска для ИНН {inn}")
             try:
-                logger.info(f"Подключение к CDP по адресу: {cdp_endpoint} для ИНН {inn}")
-                browser = await p.chromium.connect_over_cdp(cdp_endpoint)
-                context = await browser.new_context()
-                start_time = time.time()
-                page = await context.new_page()
-            except PlaywrightError as e:
-                logger.error(f"Ошибка инициализации браузера для ИНН {inn}: {str(e)}")
-                return {"status": "error", "message": f"Ошибка инициализации браузера: {str(e)}", "inn": inn}
+                await page.wait_for_response(
+                    lambda r: r.request.method == "POST" and "pb.nalog.ru" in r.url,
+                    timeout=10000
+                )
+            except PlaywrightError:
+                logger.warning(f"Не дождался ответа поиска для ИНН {inn}, проверяю DOM")
+            await page.wait_for_selector(
+                "div.no-data:not(.d-none), div.data:not(.d-none), div.alert",
+                timeout=5000
+            )
+
+            # Предупреждение о лимите, отсутствие данных и сами группы
+            # снимаются одним evaluate — один CDP-переход вместо трёх
+            state = await page.evaluate("() => window.__pbResult()")
+            if state["alert"] and "превысили" in state["alert"]:
+                logger.warning(f"Превышен лимит запросов для ИНН {inn}")
+                return {"status": "error", "message": "Превышен лимит запросов. Пожалуйста, подождите до начала следующего часа.", "inn": inn}
+
+            if state["noData"] and "По заданным критериям поиска сведений не найдено" in state["noData"]:
+                logger.info(f"Данные для ИНН {inn}: Ничего не найдено")
+                return {"status": "success", "results": {}, "inn": inn}
+
+            result = {"status": "success", "results": {}, "inn": inn}
+            groups_data = state["groups"]
+
+            result['results'] = groups_data
+            if not groups_data:
+                logger.info(f"Данные для ИНН {inn}: Ничего не найдено")
+                return {"status": "success", "results": {}, "inn": inn}
+
+            logger.info(f"Найдено групп данных для ИНН {inn}: {len(groups_data)}")
+            return result
 
-            max_attempts = 3
-            last_error = None
+        except PlaywrightError as e:
+            logger.error(f"Попытка {attempt} не удалась для ИНН {inn}: {str(e)}")
+            last_error = str(e)
+            if attempt < max_attempts:
+                logger.info(f"Ожидаю 3 секунды перед повторной попыткой для ИНН {inn}")
+                await page.wait_for_timeout(3000)
+                continue
+            return {"status": "error", "message": f"Ошибка после {max_attempts} попыток: {last_error}", "inn": inn}
 
-            for attempt in range(1, max_attempts + 1):
+async def _get_info_nalog(inn: str, cdp_endpoint: str) -> dict:
+    """Выполняет скрейп pb.nalog.ru для одного ИНН."""
+    async with _PAGE_LIMIT:
+        try:
+            logger.info(f"Подключение к CDP по адресу: {cdp_endpoint} для ИНН {inn}")
+            pool = await get_context_pool(cdp_endpoint)
+            context = await pool.get()
+            t0 = time.perf_counter()
+        except PlaywrightError as e:
+            logger.error(f"Ошибка инициализации браузера для ИНН {inn}: {str(e)}")
+            return {"status": "error", "message": f"Ошибка инициализации браузера: {str(e)}", "inn": inn}
+
+        page = None
+        try:
+            # Сначала лёгкий путь через JSON-бэкенд; при сбое — обычная форма
+            api_result = await search_nalog_api(context, inn)
+            if api_result is not None:
+                result = api_result
+            else:
+                page = await context.new_page()
+                result = await _scrape(page, inn)
+            # Лог только по медленным запросам: на пакетах из сотен ИНН
+            # безусловная строка на каждый — чистый шум и работа форматера
+            elapsed = time.perf_counter() - t0
+            if elapsed > 2.0:
+                logger.info("Медленная обработка ИНН %s: %.2f с", inn, elapsed)
+            log_memory_usage()
+            return result
+        finally:
+            if page is not None:
                 try:
-                    url = "https://pb.nalog.ru/index.html"
-                    logger.info(f"Попытка {attempt} из {max_attempts}: Загружаю страницу pb.nalog.ru для ИНН {inn}")
-                    await page.goto(url, wait_until="load", timeout=20000)
-
-                    # Проверка на пустую страницу
-                    if page.url == "about:blank":
-                        logger.error(f"Пустая страница для ИНН {inn} на попытке {attempt}")
-                        if attempt < max_attempts:
-                            await page.wait_for_timeout(3000)
-                            continue
-                        return {"status": "error", "message": "Пустая страница, возможно, сбой браузера", "inn": inn}
-
-                    content = await page.content()
-                    if not content or "<html" not in content.lower():
-                        logger.error(f"Пустое содержимое страницы для ИНН {inn} на попытке {attempt}")
-                        if attempt < max_attempts:
-                            await page.wait_for_timeout(3000)
-                            continue
-                        return {"status": "error", "message": "Пустое содержимое страницы", "inn": inn}
-
-                    # Проверка на предупреждение о превышении лимита запросов
-                    alert = await page.query_selector("div.alert")
-                    if alert and "превысили" in (await alert.inner_text()).lower():
-                        logger.warning(f"Превышен лимит запросов для ИНН {inn}")
-                        return {"status": "error", "message": "Превышен лимит запросов. Пожалуйста, подождите до начала следующего часа.", "inn": inn}
-
-                    # Ожидание поля ввода
-                    logger.info(f"Ожидаю поле ввода для ИНН {inn}")
-                    await page.wait_for_selector("input#queryAll", timeout=10000)
-
-                    # Проверка активного режима "Общий поиск"
-                    active_mode = await page.query_selector("input#m_search-all:checked")
-                    if not active_mode:
-                        logger.info(f"Переключаюсь на режим 'Общий поиск' для ИНН {inn}")
-                        await page.click("label[for='m_search-all']")
-                        await page.wait_for_timeout(500)
-
-                    # Ввод ИНН и отправка формы
-                    logger.info(f"Ввожу ИНН {inn} в поле")
-                    await page.fill("input#queryAll", inn)
-                    logger.info(f"Нажимаю кнопку 'Искать' для ИНН {inn}")
-                    await page.click("button.btn.btn-warning[type='submit']")
-
-                    # Ожидание результата
-                    logger.info(f"Ожидаю результат до 7 секунд для ИНН {inn}")
-                    await page.wait_for_timeout(7000)
-
-                    # Проверка на предупреждение о превышении лимита запросов
-                    alert = await page.query_selector("div.alert")
-                    if alert and "превысили" in (await alert.inner_text()).lower():
-                        logger.warning(f"Превышен лимит запросов для ИНН {inn}")
-                        return {"status": "error", "message": "Превышен лимит запросов. Пожалуйста, подождите до начала следующего часа.", "inn": inn}
-
-                    # Проверка на отсутствие данных
-                    no_data = await page.query_selector("div.no-data:not(.d-none)")
-                    if no_data and "По заданным критериям поиска сведений не найдено" in await no_data.inner_text():
-                        logger.info(f"Данные для ИНН {inn}: Ничего не найдено")
-                        return {"status": "success", "results": {}, "inn": inn}
-
-                    # Извлечение данных с помощью JavaScript
-                    result = {"status": "success", "results": {}, "inn": inn}
-                    groups_data = await page.evaluate("""
-                        () => {
-                            const groups = [
-                                { key: 'ul', name: 'Организации', id: 'resultul' },
-                                { key: 'ip', name: 'Индивидуальные предприниматели', id: 'resultip' },
-                                { key: 'upr', name: 'Руководители', id: 'resultupr' },
-                                { key: 'uchr', name: 'Учредители', id: 'resultuchr' },
-                                { key: 'rdl', name: 'Дисквалификация', id: 'resultrdl' },
-                                { key: 'addr', name: 'Адреса ЮЛ', id: 'resultaddr' },
-                                { key: 'ogrfl', name: 'Ограничения ФЛ', id: 'resultogrfl' },
-                                { key: 'ogrul', name: 'Ограничения ЮЛ', id: 'resultogrul' },
-                                { key: 'docul', name: 'Документы ЮЛ', id: 'resultdocul' },
-                                { key: 'docip', name: 'Документы ИП', id: 'resultdocip' }
-                            ];
-                            const result = {};
-                            groups.forEach(group => {
-                                const groupDiv = document.querySelector(`div#${group.id}`);
-                                if (!groupDiv) return;
-                                const dataDiv = groupDiv.querySelector('div.data:not(.d-none)');
-                                if (!dataDiv) return;
-                                const groupData = [];
-                                const items = dataDiv.querySelectorAll('dl, tr');
-                                items.forEach(item => {
-                                    const record = {};
-                                    if (item.tagName.toLowerCase() === 'dl') {
-                                        const dts = item.querySelectorAll('dt');
-                                        const dds = item.querySelectorAll('dd');
-                                        dts.forEach((dt, i) => {
-                                            const label = dt.textContent.trim().replace(':', '').toLowerCase().replace(/\\s+/g, '_');
-                                            const value = dds[i] ? dds[i].textContent.trim() : '';
-                                            record[label] = value;
-                                        });
-                                    } else if (item.tagName.toLowerCase() === 'tr') {
-                                        const cells = item.querySelectorAll('th, td');
-                                        for (let i = 0; i < cells.length; i += 2) {
-                                            const label = cells[i].textContent.trim().replace(':', '').toLowerCase().replace(/\\s+/g, '_');
-                                            const value = cells[i + 1] ? cells[i + 1].textContent.trim() : '';
-                                            record[label] = value;
-                                        }
-                                    }
-                                    if (Object.keys(record).length > 0) {
-                                        groupData.push(record);
-                                    }
-                                });
-                                if (groupData.length > 0) {
-                                    result[group.key] = { name: group.name, data: groupData };
-                                }
-                            });
-                            return result;
-                        }
-                    """)
-
-                    result['results'] = groups_data
-                    if not groups_data:
-                        logger.info(f"Данные для ИНН {inn}: Ничего не найдено")
-                        return {"status": "success", "results": {}, "inn": inn}
-
-                    logger.info(f"Найдено групп данных для ИНН {inn}: {len(groups_data)}")
-                    logger.info(f"Обработка ИНН {inn} заняла {time.time() - start_time:.2f} секунд")
-                    log_memory_usage()
-                    return result
-
-                except PlaywrightError as e:
-                    logger.error(f"Попытка {attempt} не удалась для ИНН {inn}: {str(e)}")
-                    last_error = str(e)
-                    if attempt < max_attempts:
-                        logger.info(f"Ожидаю 3 секунды перед повторной попыткой для ИНН {inn}")
-                        await page.wait_for_timeout(3000)
-                        continue
-                    return {"status": "error", "message": f"Ошибка после {max_attempts} попыток: {last_error}", "inn": inn}
+                    await page.close()
+                except Exception as e:
+                    logger.error(f"Ошибка при закрытии страницы для ИНН {inn}: {str(e)}")
+            pool.put_nowait(context)
 
-                finally:
+async def process_multiple_inns(inns: list, cdp_endpoint: str, disable_cache: bool = False) -> list:
+    """Обработка списка ИНН с общим лимитом одновременных скрейпов.
+
+    Порядок захвата везде один — сначала _PAGE_LIMIT, затем контекст из
+    пула: держать контекст на весь пакет нельзя, обратный порядок
+    взаимно блокировался с одиночными запросами."""
+    t0 = time.perf_counter()
+    pool = await get_context_pool(cdp_endpoint)
+
+    async def run_one(inn: str) -> dict:
+        async def scrape_on_context():
+            async with _PAGE_LIMIT:
+                context = await pool.get()
+                try:
+                    api_result = await search_nalog_api(context, inn)
+                    if api_result is not None:
+                        return api_result
+                    page = await context.new_page()
                     try:
+                        return await _scrape(page, inn)
+                    finally:
                         await page.close()
-                        await context.close()
-                        await browser.close()
-                    except Exception as e:
-                        logger.error(f"Ошибка при закрытии ресурсов для ИНН {inn}: {str(e)}")
-
-async def process_multiple_inns(inns: list, cdp_endpoint: str) -> list:
-    """Параллельная обработка списка ИНН."""
-    start_time = time.time()
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-    tasks = [get_info_nalog(inn, semaphore, cdp_endpoint) for inn in inns]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    logger.info(f"Обработка {len(inns)} ИНН заняла {time.time() - start_time:.2f} секунд")
+                finally:
+                    pool.put_nowait(context)
+        return await _single_flight(inn, scrape_on_context, disable_cache)
+
+    results = await asyncio.gather(*(run_one(inn) for inn in inns), return_exceptions=True)
+    logger.info("Обработка %d ИНН заняла %.2f секунд", len(inns), time.perf_counter() - t0)
     log_memory_usage()
     return results
 
 @app.route('/nalog', methods=['POST'])
 async def nalog_endpoint():
     """Эндпоинт для получения данных с pb.nalog.ru для одного или нескольких ИНН."""
-    data = request.get_json()
+    data = await request.get_json()
     inn = data.get('inn')
     inns = data.get('inns', [])
     cdp_endpoint = data.get('cdp_endpoint', 'http://localhost:9222')
-
-    def is_valid_inn(inn):
-        return inn and re.match(r'^\d{10}$|^\d{12}$', inn)
+    disable_cache = bool(data.get('disable_cache', False))
 
     if inn and is_valid_inn(inn):
         try:
-            result = await get_info_nalog(inn, asyncio.Semaphore(1), cdp_endpoint)
+            result = await get_info_nalog(inn, cdp_endpoint, disable_cache)
             return jsonify(result)
         except Exception as e:
             logger.error(f"Ошибка обработки запроса для ИНН {inn}: {str(e)}")
-            return jsonify({"status": "error", "message": f"Ошибка обработки запроса: {str(e)}"}), 500
+            return jsonify({"status": "error", "message": f"Ошибка обработки запроса: {str(e)}"}, 500)
     elif inns:
         invalid_inns = [inn for inn in inns if not is_valid_inn(inn)]
         if invalid_inns:
-            return jsonify({"status": "error", "message": f"Неверный формат ИНН: {invalid_inns}"}), 400
+            return jsonify({"status": "error", "message": f"Неверный формат ИНН: {invalid_inns}"}, 400)
         try:
-            results = await process_multiple_inns(inns, cdp_endpoint)
+            results = await process_multiple_inns(inns, cdp_endpoint, disable_cache)
             return jsonify({"status": "success", "results": results})
         except Exception as e:
             logger.error(f"Ошибка обработки списка ИНН: {str(e)}")
-            return jsonify({"status": "error", "message": f"Ошибка обработки списка ИНН: {str(e)}"}), 500
+            return jsonify({"status": "error", "message": f"Ошибка обработки списка ИНН: {str(e)}"}, 500)
     else:
-        return jsonify({"status": "error", "message": "Не указан ИНН или список ИНН"}), 400
+        return jsonify({"status": "error", "message": "Не указан ИНН или список ИНН"}, 400)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5007)
\ No newline at end of file
@@ -1,10 +1,13 @@
 import asyncio
+import json
 import logging
 import re
+import orjson
 import psutil
 import time
-from flask import Flask, request, jsonify
+from quart import Quart, request
 from playwright.async_api import async_playwright, Error as PlaywrightError
+from cachetools import TTLCache
 import os
 import dotenv
 
@@ -17,11 +20,27 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logging.getLogger('httpx').setLevel(logging.WARNING)
 
-app = Flask(__name__)
+# Продакшен-запуск: hypercorn parsers.reestr_zalogov_parser:app --bind 0.0.0.0:5008
+app = Quart(__name__)
+
+# Локальная замена quart.jsonify: orjson сериализует большие пакеты
+# результатов в разы быстрее stdlib json и с меньшим давлением на GC
+def jsonify(obj, status=200):
+    return app.response_class(orjson.dumps(obj), status=status, mimetype="application/json")
+
 
 # Ограничения
 MAX_CONCURRENT_REQUESTS = 2  # Параллельные запросы на сервис
-GLOBAL_SEMAPHORE = asyncio.Semaphore(10)  # Общий лимит страниц для всех сервисов
+_PAGE_LIMIT = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)  # Единый лимит одновременных скрейпов
+
+# Шаблон VIN компилируется один раз при импорте модуля
+VIN_RE = re.compile(r'^[A-HJ-NPR-Z0-9]{17}$', re.IGNORECASE)
+
+def is_valid_vin(vin):
+    return vin and VIN_RE.match(vin)
+
+class CaptchaError(Exception):
+    """Сайт показал капчу — остальные запросы пакета обречены на то же."""
 
 # Загрузка переменных окружения
 dotenv_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env")
@@ -35,50 +54,251 @@ proxy_pool = [
     },
 ]
 
+# Объект процесса создаётся один раз; сами записи прорежены по времени —
+# под нагрузкой память меняется медленнее, чем приходят запросы
+_PROC = psutil.Process()
+_MEM_LOG_INTERVAL = 5.0
+_last_mem_log = 0.0
+
 def log_memory_usage():
-    """Логирование потребления памяти."""
-    process = psutil.Process()
-    mem_info = process.memory_info()
+    """Логирование потребления памяти, не чаще раза в _MEM_LOG_INTERVAL секунд."""
+    global _last_mem_log
+    now = time.monotonic()
+    if now - _last_mem_log < _MEM_LOG_INTERVAL:
+        return
+    _last_mem_log = now
+    mem_info = _PROC.memory_info()
     logger.info(f"Потребление памяти: {mem_info.rss / 1024 / 1024:.2f} МБ")
 
-async def get_pledge_info(vin: str, semaphore: asyncio.Semaphore, cdp_endpoint: str = "http://localhost:9222") -> dict:
-    """Получение данных о залоге ТС с reestr-zalogov.ru для одного VIN."""
-    async with GLOBAL_SEMAPHORE:
-        async with async_playwright() as p:
-            try:
-                logger.info(f"Подключение к CDP по адресу: {cdp_endpoint} для VIN {vin}")
-                browser = await p.chromium.connect_over_cdp(cdp_endpoint)
-                context = await browser.new_context()
-                start_time = time.time()
-                page = await context.new_page()
-            except PlaywrightError as e:
-                logger.error(f"Ошибка инициализации браузера для VIN {vin}: {str(e)}")
-                return {"status": "error", "message": f"Ошибка инициализации браузера: {str(e)}", "vin": vin}
-
-            max_attempts = 3
-            last_error = None
+# Картинки, шрифты и счётчики не влияют на результат — обрываем их на роутере
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media", "stylesheet"}
+BLOCKED_URL_PARTS = ("google-analytics", "mc.yandex", "mail.ru")
+
+async def _block_unneeded(route):
+    """Обрывает запросы к ресурсам, не нужным для скрейпинга."""
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(part in request.url for part in BLOCKED_URL_PARTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+# Постоянный Playwright и пул тёплых контекстов: CDP-подключение
+# выполняется один раз на процесс, а не на каждый запрос
+_playwright = None
+_browser = None
+_context_pool = None
+_pool_endpoint = None
+_pool_lock = asyncio.Lock()
+
+async def get_context_pool(cdp_endpoint: str = "http://localhost:9222") -> asyncio.LifoQueue:
+    """Возвращает пул контекстов, создавая его при первом обращении."""
+    global _playwright, _browser, _context_pool, _pool_endpoint
+    async with _pool_lock:
+        if _context_pool is not None and cdp_endpoint != _pool_endpoint:
+            # Пул один на процесс; другой CDP-адрес в запросе обслужить нечем
+            logger.warning(f"Пул контекстов создан для CDP {_pool_endpoint}, запрошенный {cdp_endpoint} игнорируется")
+        if _context_pool is None:
+            _pool_endpoint = cdp_endpoint
+            logger.info(f"Создаю пул контекстов: подключение к CDP {cdp_endpoint}")
+            _playwright = await async_playwright().start()
+            _browser = await _playwright.chromium.connect_over_cdp(cdp_endpoint)
+            pool = asyncio.LifoQueue()
+            for _ in range(MAX_CONCURRENT_REQUESTS):
+                context = await _browser.new_context(proxy=proxy_pool[0])
+                await context.route("**/*", _block_unneeded)
+                pool.put_nowait(context)
+            _context_pool = pool
+    return _context_pool
+
+# Драйвер Playwright (процесс node) поднимается один раз на старте
+# сервера, а не лениво на первом запросе, и гасится вместе с ним
+@app.before_serving
+async def _startup_pool():
+    """Создаёт пул контекстов и прогревает сайт до приёма первого запроса."""
+    # Недоступный на старте CDP не валит сервис: пул тогда создастся
+    # лениво первым запросом, а до тех пор клиенты получают ошибку в ответе
+    try:
+        pool = await get_context_pool()
+    except Exception as e:
+        logger.warning(f"Пул контекстов на старте не создан: {str(e)}")
+        return
+    # Первый заход платит за DNS, TLS и холодный HTTP-кеш — делаем его до
+    # прихода трафика; контекст с куками и TLS-сессией возвращается в пул
+    context = await pool.get()
+    try:
+        warm = await context.new_page()
+        try:
+            await warm.goto("https://www.reestr-zalogov.ru/search/index", wait_until="domcontentloaded", timeout=20000)
+        finally:
+            await warm.close()
+    except Exception as e:
+        logger.warning(f"Прогрев reestr-zalogov.ru не удался: {str(e)}")
+    finally:
+        pool.put_nowait(context)
+
+@app.after_serving
+async def _shutdown_pool():
+    """Закрывает браузер и драйвер Playwright при остановке сервера."""
+    global _playwright, _browser, _context_pool
+    try:
+        if _browser is not None:
+            await _browser.close()
+        if _playwright is not None:
+            await _playwright.stop()
+    except Exception as e:
+        logger.error(f"Ошибка при закрытии пула контекстов: {str(e)}")
+    _playwright = _browser = _context_pool = None
+
+# Поиск на странице уходит в JSON-бэкенд — тот же запрос можно отправить
+# напрямую, без загрузки Vue-приложения и кликов по вкладкам
+PLEDGE_SEARCH_URL = "https://www.reestr-zalogov.ru/api/search/notary"
+PLEDGE_HEADERS = {
+    "Content-Type": "application/json;charset=UTF-8",
+    "Accept": "application/json, text/plain, */*",
+    "Origin": "https://www.reestr-zalogov.ru",
+    "Referer": "https://www.reestr-zalogov.ru/search/index",
+    "X-Requested-With": "XMLHttpRequest",
+}
+
+def _parse_api_items(payload, vin):
+    """Преобразует ответ JSON-бэкенда в формат результата скрейпа."""
+    if not isinstance(payload, dict):
+        return None
+    items = payload.get("items")
+    if items is None:
+        return None
+    if not items:
+        return {"status": "success", "results": {}, "vin": vin}
+    details = []
+    for item in items:
+        if not isinstance(item, dict):
+            return None
+        pledgors = item.get("pledgors") or []
+        names = ", ".join(p.get("name", "") for p in pledgors if isinstance(p, dict))
+        details.append({
+            "case_number": item.get("referenceNumber", ""),
+            "date": item.get("registrationDate", ""),
+            "pledgor": names,
+        })
+    return {
+        "status": "success",
+        "results": {"search_params": f"VIN: {vin}", "details": details},
+        "vin": vin,
+    }
+
+async def search_pledge_api(context, vin: str):
+    """Пытается получить данные о залоге напрямую из JSON-бэкенда.
+
+    Возвращает None при любом сбое (не 200, капча, смена формата) —
+    в этом случае выполняется обычный DOM-путь.
+    """
+    body = {
+        "filter": {"vehicleProperty": {"vin": vin}},
+        "limit": 50,
+        "offset": 0,
+        "mode": "ALL",
+    }
+    try:
+        response = await context.request.post(
+            PLEDGE_SEARCH_URL,
+            data=json.dumps(body),
+            headers=PLEDGE_HEADERS,
+            timeout=10000,
+        )
+        if response.status != 200:
+            logger.info(f"JSON-бэкенд залогов вернул статус {response.status} для VIN {vin}")
+            return None
+        return _parse_api_items(await response.json(), vin)
+    except Exception as e:
+        logger.info(f"Не удалось обратиться к JSON-бэкенду залогов для VIN {vin}: {str(e)}")
+        return None
+
+# Повторные обращения за тем же VIN в течение часа отдаются из кеша,
+# а одновременные дубли схлопываются в один скрейп
+_RESULTS_CACHE = TTLCache(maxsize=10_000, ttl=3600)
+_INFLIGHT = {}
+
+async def _single_flight(key, coro_factory, disable_cache=False):
+    """Возвращает закешированный или уже вычисляемый результат по ключу."""
+    if not disable_cache:
+        cached = _RESULTS_CACHE.get(key)
+        if cached is not None:
+            return cached
+    fut = _INFLIGHT.get(key)
+    if fut is not None:
+        return await asyncio.shield(fut)
+    fut = asyncio.get_event_loop().create_future()
+    _INFLIGHT[key] = fut
+    try:
+        result = await coro_factory()
+        fut.set_result(result)
+        if isinstance(result, dict) and result.get("status") == "success":
+            _RESULTS_CACHE[key] = result
+        return result
+    except BaseException as e:
+        # BaseException, а не Exception: TaskGroup при капче отменяет
+        # соседние задачи, и отменённый владелец ключа обязан разрешить
+        # future — иначе ждущие под shield из других запросов повиснут
+        fut.set_exception(e)
+        fut.exception()  # гасим "exception never retrieved", если ждущих нет
+        raise
+    finally:
+        _INFLIGHT.pop(key, None)
 
+async def get_pledge_info(vin: str, cdp_endpoint: str = "http://localhost:9222", disable_cache: bool = False) -> dict:
+    """Получение данных о залоге ТС с reestr-zalogov.ru (с кешем и дедупликацией)."""
+    return await _single_flight(vin, lambda: _get_pledge_info(vin, cdp_endpoint), disable_cache)
+
+async def _get_pledge_info(vin: str, cdp_endpoint: str) -> dict:
+    """Выполняет скрейп reestr-zalogov.ru для одного VIN."""
+    async with _PAGE_LIMIT:
+        try:
+            logger.info(f"Подключение к CDP по адресу: {cdp_endpoint} для VIN {vin}")
+            pool = await get_context_pool(cdp_endpoint)
+            context = await pool.get()
+            t0 = time.perf_counter()
+        except PlaywrightError as e:
+            logger.error(f"Ошибка инициализации браузера для VIN {vin}: {str(e)}")
+            return {"status": "error", "message": f"Ошибка инициализации браузера: {str(e)}", "vin": vin}
+
+        max_attempts = 3
+        last_error = None
+        page = None
+
+        try:
+            # Быстрый путь: прямой запрос к JSON-бэкенду
+            api_result = await search_pledge_api(context, vin)
+            if api_result is not None:
+                logger.info(f"Данные для VIN {vin} получены напрямую из JSON-бэкенда")
+                log_memory_usage()
+                return api_result
+
+            # Бэкенд недоступен или сменил формат — обычный DOM-путь
+            page = await context.new_page()
             for attempt in range(1, max_attempts + 1):
                 try:
                     url = "https://www.reestr-zalogov.ru/search/index"
                     logger.info(
                         f"Попытка {attempt} из {max_attempts}: Загружаю страницу reestr-zalogov.ru для VIN {vin}")
-                    await page.goto(url, wait_until="networkidle", timeout=60000)
+                    # networkidle ждал затухания аналитики до 60 секунд;
+                    # достаточно DOM и появления вкладок поиска
+                    await page.goto(url, wait_until="domcontentloaded", timeout=20000)
+                    await page.wait_for_selector("ul.nav-pills > li:nth-child(3) > a", timeout=10000)
 
                     # Проверка на капчу
                     if await page.query_selector("div.captcha"):
                         logger.error(f"Обнаружена капча для VIN {vin}")
-                        return {"status": "error", "message": "Обнаружена капча, попробуйте позже", "vin": vin}
+                        raise CaptchaError("Обнаружена капча, попробуйте позже")
 
                     # Выбор категории поиска - "По информации о предмете залога"
                     logger.info(f"Выбираю категорию поиска для VIN {vin}")
                     await page.click("ul.nav-pills > li:nth-child(3) > a")
-                    await page.wait_for_timeout(2000)
+                    # Vue дорисовывает вкладки типов — ждём появления нужной, а не 2 секунды
+                    await page.wait_for_selector("div[data-v-610150a0] ul.nav-pills > li:nth-child(1) > a", timeout=5000)
 
                     # Выбор типа ТС - "Транспортное средство"
                     logger.info(f"Выбираю транспортное средство для VIN {vin}")
                     await page.click("div[data-v-610150a0] ul.nav-pills > li:nth-child(1) > a")
-                    await page.wait_for_timeout(2000)
 
                     # Ожидание формы ввода VIN
                     logger.info(f"Ожидаю форму ввода для VIN {vin}")
@@ -91,29 +311,30 @@ async def get_pledge_info(vin: str, semaphore: asyncio.Semaphore, cdp_endpoint:
                         logger.error(f"Поле VIN не найдено для VIN {vin}")
                         return {"status": "error", "message": "Поле VIN не найдено", "vin": vin}
                     await vin_input.fill(vin)
-                    await page.wait_for_timeout(1000)
 
                     # Нажатие кнопки поиска
                     logger.info(f"Нажимаю кнопку поиска для VIN {vin}")
                     await page.click("#find-btn")
                     await page.wait_for_selector("div.search-results, div.search-error-label", timeout=15000)
 
-                    # Проверка на блокировку IP
-                    error_label = await page.query_selector("div.search-error-label")
-                    if error_label:
-                        error_text = await error_label.text_content()
-                        if "Доступ запрещен" in error_text and "похожи на автоматические" in error_text:
-                            logger.error(f"IP-адрес заблокирован для VIN {vin}")
-                            return {"status": "error", "message": "IP-адрес заблокирован сайтом", "vin": vin}
-
-                    # Извлечение данных с помощью JavaScript
+                    # Капча, блокировка IP, «не найдено» и таблица результатов
+                    # снимаются одним evaluate — один CDP-переход вместо четырёх
                     result = {"status": "success", "results": {"details": []}, "vin": vin}
                     data = await page.evaluate("""
                         () => {
+                            if (document.querySelector('div.captcha')) {
+                                return { captcha: true };
+                            }
                             const result = { details: [], search_params: '' };
                             const errorBlock = document.querySelector('div.search-error-label');
-                            if (errorBlock && errorBlock.textContent.includes('не найдено')) {
-                                return { error: 'По заданным критериям поиска сведений не найдено' };
+                            if (errorBlock) {
+                                const text = errorBlock.textContent;
+                                if (text.includes('Доступ запрещен') && text.includes('похожи на автоматические')) {
+                                    return { blocked: true };
+                                }
+                                if (text.includes('не найдено')) {
+                                    return { error: 'По заданным критериям поиска сведений не найдено' };
+                                }
                             }
 
                             const searchParams = document.querySelector('div.search-params-tip');
@@ -121,7 +342,7 @@ async def get_pledge_info(vin: str, semaphore: asyncio.Semaphore, cdp_endpoint:
                                 result.search_params = searchParams.textContent.trim();
                             }
 
-                            const table = document.query_selector('table.search-results');
+                            const table = document.querySelector('table.search-results');
                             if (table) {
                                 const rows = table.querySelectorAll('tr');
                                 rows.forEach((row, index) => {
@@ -140,6 +361,14 @@ async def get_pledge_info(vin: str, semaphore: asyncio.Semaphore, cdp_endpoint:
                         }
                     """)
 
+                    if data.get("captcha"):
+                        logger.error(f"Обнаружена капча для VIN {vin}")
+                        raise CaptchaError("Обнаружена капча, попробуйте позже")
+
+                    if data.get("blocked"):
+                        logger.error(f"IP-адрес заблокирован для VIN {vin}")
+                        return {"status": "error", "message": "IP-адрес заблокирован сайтом", "vin": vin}
+
                     if "error" in data:
                         logger.info(f"Данные для VIN {vin}: Ничего не найдено")
                         return {"status": "success", "results": {}, "vin": vin}
@@ -148,7 +377,11 @@ async def get_pledge_info(vin: str, semaphore: asyncio.Semaphore, cdp_endpoint:
                     result["results"]["details"] = data["details"]
 
                     logger.info(f"Найдено записей для VIN {vin}: {len(data['details'])}")
-                    logger.info(f"Обработка VIN {vin} заняла {time.time() - start_time:.2f} секунд")
+                    # Лог только по медленным запросам — на пакетах безусловная
+                    # строка на каждый VIN лишь раздувает журнал
+                    elapsed = time.perf_counter() - t0
+                    if elapsed > 2.0:
+                        logger.info("Медленная обработка VIN %s: %.2f с", vin, elapsed)
                     log_memory_usage()
                     return result
 
@@ -162,54 +395,81 @@ async def get_pledge_info(vin: str, semaphore: asyncio.Semaphore, cdp_endpoint:
                     return {"status": "error", "message": f"Ошибка после {max_attempts} попыток: {last_error}",
                             "vin": vin}
 
-                finally:
-                    try:
-                        await page.close()
-                        await context.close()
-                        await browser.close()
-                    except Exception as e:
-                        logger.error(f"Ошибка при закрытии ресурсов для VIN {vin}: {str(e)}")
-
-async def process_multiple_vins(vins: list, cdp_endpoint: str) -> list:
-    """Параллельная обработка списка VIN."""
-    start_time = time.time()
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-    tasks = [get_pledge_info(vin, semaphore, cdp_endpoint) for vin in vins]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    logger.info(f"Обработка {len(vins)} VIN заняла {time.time() - start_time:.2f} секунд")
+        finally:
+            # Страница закрывается, тёплый контекст возвращается в пул
+            if page is not None:
+                try:
+                    await page.close()
+                except Exception as e:
+                    logger.error(f"Ошибка при закрытии страницы для VIN {vin}: {str(e)}")
+            pool.put_nowait(context)
+
+async def process_multiple_vins(vins: list, cdp_endpoint: str, disable_cache: bool = False) -> list:
+    """Параллельная обработка списка VIN; капча останавливает весь пакет."""
+    t0 = time.perf_counter()
+
+    async def run_one(vin):
+        # Обычные ошибки возвращаются значением (как при return_exceptions),
+        # наружу пробивается только CaptchaError — она отменяет соседей
+        try:
+            return await get_pledge_info(vin, cdp_endpoint, disable_cache)
+        except CaptchaError:
+            raise
+        except Exception as e:
+            return e
+
+    # Пары (vin, task), а не словарь: дубли VIN в пакете должны дать
+    # по записи на каждую входную позицию
+    tasks = []
+    try:
+        async with asyncio.TaskGroup() as tg:
+            for vin in vins:
+                tasks.append((vin, tg.create_task(run_one(vin))))
+    except* CaptchaError:
+        logger.error("Обнаружена капча — оставшиеся VIN пакета отменены")
+
+    results = []
+    for vin, task in tasks:
+        if task.cancelled():
+            results.append({"status": "error", "message": "Поиск остановлен: обнаружена капча", "vin": vin})
+        elif task.exception() is not None:
+            results.append({"status": "error", "message": str(task.exception()), "vin": vin})
+        else:
+            results.append(task.result())
+    logger.info("Обработка %d VIN заняла %.2f секунд", len(vins), time.perf_counter() - t0)
     log_memory_usage()
     return results
 
 @app.route('/pledge', methods=['POST'])
 async def pledge_endpoint():
     """Эндпоинт для получения данных о залоге с reestr-zalogov.ru для одного или нескольких VIN."""
-    data = request.get_json()
+    data = await request.get_json()
     vin = data.get('vin')
     vins = data.get('vins', [])
     cdp_endpoint = data.get('cdp_endpoint', 'http://localhost:9222')
-
-    def is_valid_vin(vin):
-        return vin and re.match(r'^[A-HJ-NPR-Z0-9]{17}$', vin, re.IGNORECASE)
+    disable_cache = bool(data.get('disable_cache', False))
 
     if vin and is_valid_vin(vin):
         try:
-            result = await get_pledge_info(vin, asyncio.Semaphore(1), cdp_endpoint)
+            result = await get_pledge_info(vin, cdp_endpoint, disable_cache)
             return jsonify(result)
+        except CaptchaError as e:
+            return jsonify({"status": "error", "message": str(e), "vin": vin})
         except Exception as e:
             logger.error(f"Ошибка обработки запроса для VIN {vin}: {str(e)}")
-            return jsonify({"status": "error", "message": f"Ошибка обработки запроса: {str(e)}"}), 500
+            return jsonify({"status": "error", "message": f"Ошибка обработки запроса: {str(e)}"}, 500)
     elif vins:
         invalid_vins = [vin for vin in vins if not is_valid_vin(vin)]
         if invalid_vins:
-            return jsonify({"status": "error", "message": f"Неверный формат VIN: {invalid_vins}"}), 400
+            return jsonify({"status": "error", "message": f"Неверный формат VIN: {invalid_vins}"}, 400)
         try:
-            results = await process_multiple_vins(vins, cdp_endpoint)
+            results = await process_multiple_vins(vins, cdp_endpoint, disable_cache)
             return jsonify({"status": "success", "results": results})
         except Exception as e:
             logger.error(f"Ошибка обработки списка VIN: {str(e)}")
-            return jsonify({"status": "error", "message": f"Ошибка обработки списка VIN: {str(e)}"}), 500
+            return jsonify({"status": "error", "message": f"Ошибка обработки списка VIN: {str(e)}"}, 500)
     else:
-        return jsonify({"status": "error", "message": "Не указан VIN или список VIN"}), 400
+        return jsonify({"status": "error", "message": "Не указан VIN или список VIN"}, 400)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5008)
\ No newline at end of file